@@ -16,6 +16,14 @@ ES_PAYING_USERS_INDEX = os.getenv(
     "ES_PAYING_USERS_INDEX", "paying-users")
 ES_ACTIVE_PAYING_USERS_INDEX = os.getenv(
     "ES_ACTIVE_PAYING_USERS_INDEX", "active-paying-users")
+# 为空时每次全量查询
+PAYING_USERS_CACHE_DIR = os.getenv("PAYING_USERS_CACHE_DIR", "")
+# paying-users.py按天写入，@timestamp是处理的那一天的0点，不是付费时间
+# 补算或者重新计算之前的日期时，文档的@timestamp在水位之前
+# 从水位之前这么多秒开始查询，需要覆盖可能补算的最早日期，重复的id会被去重
+# 默认一天，覆盖重新计算水位的前一天
+PAYING_USERS_LOOKBACK = int(os.getenv("PAYING_USERS_LOOKBACK", 86400))
+ONE_SECOND_MILLIS = 1000
 
 # channel diff in CHANNELS
 # upper or lower not in CHANNELS
@@ -71,6 +79,10 @@ def process(time_str):
 # ==========================for compute retention==============================
 
 
+def get_inputs(time_str):
+    return util.get_log_inputs(PLAYER_LOGIN_EVENT, S3_KEY_PREFIX, [time_str])
+
+
 def compute(time_str):
     login_counts = {}
     paying_users = get_paying_users()
@@ -84,16 +96,70 @@ def compute(time_str):
     return login_counts, platform_and_channels
 
 
+# paying-users 只追加，本地缓存id后只查询水位之后的文档
 def get_paying_users():
-    ret = set()
-    logger.info("Get pay player from es")
-    logs = es.query_match_all(ES_PAYING_USERS_INDEX, es.get_match_all_dsl())
-    logger.info(f"Pay player size is {len(logs)}")
-    for log in logs:
-        ret.add(log["_id"])
+    ret, watermark = load_paying_users()
+    start_timestamp = None
+    if watermark is not None:
+        start_timestamp = max(
+            0, watermark - PAYING_USERS_LOOKBACK * ONE_SECOND_MILLIS)
+    logger.info(
+        f"Get pay player from es. watermark: {watermark} ."
+        f"start timestamp: {start_timestamp}")
+    new_ids = []
+    max_timestamp = watermark
+    for logs in es.scroll_pages(
+            ES_PAYING_USERS_INDEX,
+            es.get_ids_dsl(timestamp=start_timestamp)):
+        for log in logs:
+            if log["_id"] not in ret:
+                ret.add(log["_id"])
+                new_ids.append(log["_id"])
+            timestamp = es.get_doc_timestamp(log)
+            if timestamp is not None and (
+                    max_timestamp is None or timestamp > max_timestamp):
+                max_timestamp = timestamp
+    save_paying_users(new_ids, max_timestamp)
+    logger.info(
+        f"Pay player size is {len(ret)} . new size: {len(new_ids)}")
     return ret
 
 
+def get_paying_users_paths():
+    path = os.path.join(PAYING_USERS_CACHE_DIR, ES_PAYING_USERS_INDEX)
+    return path + ".ids", path + ".watermark"
+
+
+def load_paying_users():
+    ret = set()
+    if util.is_empty(PAYING_USERS_CACHE_DIR):
+        return ret, None
+    ids_path, watermark_path = get_paying_users_paths()
+    if not os.path.exists(watermark_path):
+        return ret, None
+    with open(watermark_path) as f:
+        watermark = int(f.read().strip())
+    with open(ids_path) as f:
+        for line in f:
+            ret.add(line.rstrip("\n"))
+    return ret, watermark
+
+
+# 先追加id再更新水位，中途退出时下次会重复查询，不会丢失
+def save_paying_users(new_ids, watermark):
+    if util.is_empty(PAYING_USERS_CACHE_DIR) or watermark is None:
+        return
+    os.makedirs(PAYING_USERS_CACHE_DIR, exist_ok=True)
+    ids_path, watermark_path = get_paying_users_paths()
+    with open(ids_path, "a") as f:
+        for player_id in new_ids:
+            f.write(player_id + "\n")
+    tmp_path = watermark_path + "." + str(os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write(str(watermark))
+    os.replace(tmp_path, watermark_path)
+
+
 def get_login_players(time_str):
     players = {}
     platform_and_channels = {}
@@ -132,14 +198,15 @@ def add_player_by_platform_and_channel(players, platform_and_channels, log):
 def output_to_es(time_str, login_counts, platform_and_channels):
     if len(login_counts) == 0:
         return
+    writer = es.BulkWriter()
     for key, count in login_counts.items():
-        path = ES_ACTIVE_PAYING_USERS_INDEX + "/_doc/" + key
         platform_and_channel = platform_and_channels[key]
         platform = platform_and_channel["platform"]
         channel = platform_and_channel["channel"]
         data = es_get_doc(time_str, count, platform, channel)
-        es.add_doc(path, data)
-        logger.info(f"Output to es. path: {path}. data is {data}")
+        writer.add(ES_ACTIVE_PAYING_USERS_INDEX, key, data)
+        logger.info(f"Output to es. id: {key}. data is {data}")
+    writer.close()
 
 
 def es_get_doc(time_str, login_count, platform, channel):
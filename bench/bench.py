@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+import argparse
+import gc
+import importlib
+import io
+import logging
+import sys
+import time
+import tracemalloc
+
+from util import util
+from es import es
+from eslog import eslog
+from model import PlayerIdMap, CompactPlayerIdMap, BitmapPlayerIdMap
+from model.compact import PlayerIdInterner
+from bench import generator
+
+BENCH_SIZES = "100000"
+BENCH_BACKENDS = "set,compact,bitmap"
+BENCH_INDEX = "bench"
+BENCH_BUCKET = "bench"
+BENCH_KEY = "bench.log"
+COMMA = ","
+ONE_MB = 1024 * 1024
+
+BASELINE_BACKEND = "set"
+
+# 同一个用例的PlayerIdMap共用一个interner，才会走整数数组的计算
+BACKENDS = {
+    "set": lambda interner: PlayerIdMap(),
+    "compact": lambda interner: CompactPlayerIdMap(interner),
+    "bitmap": lambda interner: BitmapPlayerIdMap(interner)
+}
+
+logger = logging.getLogger()
+
+
+def arg_parse(*args, **kwargs):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s", "--sizes",
+        default=BENCH_SIZES,
+        help="Line sizes, separated by comma. The default is 100000"
+    )
+    parser.add_argument(
+        "-c", "--cases",
+        default=COMMA.join(CASES),
+        help="Cases to run, separated by comma. The default is all cases: "
+        + COMMA.join(CASES)
+    )
+    parser.add_argument(
+        "-b", "--backends",
+        default=BENCH_BACKENDS,
+        help="PlayerIdMap backends, separated by comma. "
+        "The default is set,compact,bitmap"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=generator.DEFAULT_SEED,
+        help="Seed of the synthetic logs"
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip the tracemalloc run of every case"
+    )
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(COMMA)]
+    cases = [case.strip() for case in args.cases.split(COMMA)]
+    backends = [backend.strip() for backend in args.backends.split(COMMA)]
+    valid_params(cases, backends)
+    init_logger()
+    print_header()
+    for size in sizes:
+        run_size(size, cases, backends, args.seed, not args.no_memory)
+
+
+def valid_params(cases, backends):
+    for case in cases:
+        if case not in CASES:
+            logger.error(f"Params error. unknown case: {case}")
+            raise RuntimeError()
+    for backend in backends:
+        if backend not in BACKENDS:
+            logger.error(f"Params error. unknown backend: {backend}")
+            raise RuntimeError()
+
+
+# 计算脚本的日志不写入es，也不输出info日志
+def init_logger():
+    logger.setLevel(logging.WARNING)
+    for handler in list(logger.handlers):
+        if isinstance(handler, eslog.ESLogHandler):
+            logger.removeHandler(handler)
+
+
+def run_size(size, cases, backends, seed, memory):
+    data = Dataset(size, seed)
+    for case in cases:
+        prepare, use_backend = CASES[case]
+        for backend in (backends if use_backend else ["-"]):
+            run, items = prepare(data, backend)
+            seconds, result = measure_time(run)
+            if use_backend:
+                valid_result(data, case, backend, result)
+            peak = measure_memory(run) if memory else None
+            print_result(case, backend, size, items, seconds, peak)
+
+
+# 各后端的结果必须和set后端一致，否则计时没有意义
+def valid_result(data, case, backend, result):
+    expected = data.get_expected(case)
+    if result != expected:
+        logger.error(
+            f"Bench result error. case: {case} . backend: {backend} .")
+        raise RuntimeError()
+
+
+def measure_time(run):
+    gc.collect()
+    start = time.perf_counter()
+    result = run()
+    return time.perf_counter() - start, result
+
+
+# tracemalloc会让执行变慢，只用来统计内存峰值
+def measure_memory(run):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def print_header():
+    print(f"{'case':<20} {'backend':<8} {'size':>10} {'items':>10} "
+          f"{'seconds':>9} {'items/s':>12} {'peak MB':>9}")
+
+
+def print_result(case, backend, size, items, seconds, peak):
+    rate = items / seconds if seconds > 0 else 0
+    peak_str = "-" if peak is None else f"{peak / ONE_MB:.1f}"
+    print(f"{case:<20} {backend:<8} {size:>10} {items:>10} "
+          f"{seconds:>9.3f} {rate:>12.0f} {peak_str:>9}")
+    sys.stdout.flush()
+
+
+# 生成的日志和解析后的数据在计时之外准备，多个用例共用
+class Dataset():
+    def __init__(self, size, seed):
+        self.size = size
+        self.lines = list(generator.generate_lines(size, seed=seed))
+        self.start_time, self.end_time = generator.get_time_range()
+        self.logs = {event: [] for event in generator.EVENT_WEIGHTS}
+        for line in self.lines:
+            sub_lines = util.split_line(line)
+            self.logs[sub_lines[1]].append(util.decode_log(
+                line, sub_lines, int(sub_lines[0])))
+        self.interners = {}
+        self.maps = {}
+        self.expected = {}
+
+    def get_interner(self, backend):
+        if backend not in self.interners:
+            self.interners[backend] = PlayerIdInterner()
+        return self.interners[backend]
+
+    # 按后端缓存的(创建角色, 登录)玩家
+    def get_maps(self, backend):
+        if backend not in self.maps:
+            create_map = self.new_map(backend)
+            put_logs(create_map, self.logs[generator.CREATE_PLAYER_EVENT])
+            login_map = self.new_map(backend)
+            put_logs(login_map, self.logs[generator.PLAYER_LOGIN_EVENT])
+            self.maps[backend] = (create_map, login_map)
+        return self.maps[backend]
+
+    def new_map(self, backend):
+        return BACKENDS[backend](self.get_interner(backend))
+
+    # set后端的结果，不计时
+    def get_expected(self, case):
+        if case not in self.expected:
+            prepare, _ = CASES[case]
+            run, _ = prepare(self, BASELINE_BACKEND)
+            self.expected[case] = run()
+        return self.expected[case]
+
+
+def put_logs(player_map, logs):
+    for log in logs:
+        util.add_player_id(player_map, log)
+
+
+# 每个用例返回(run, items)，run执行一次被测代码
+def prepare_get_log(data, backend):
+    def run():
+        for line in data.lines:
+            util.get_log(
+                line, generator.PLAYER_LOGIN_EVENT, data.start_time,
+                data.end_time)
+    return run, len(data.lines)
+
+
+def prepare_get_player_id(data, backend):
+    def run():
+        for line in data.lines:
+            util.get_player_id(
+                generator.PLAYER_LOGIN_EVENT, line, data.start_time,
+                data.end_time)
+    return run, len(data.lines)
+
+
+# 内存中的对象，经过和s3相同的按行读取和解码
+def prepare_parse_object(data, backend):
+    body = "".join(data.lines).encode("utf-8")
+    client = MemoryClient({BENCH_KEY: body})
+    obj = util.S3Object(client, BENCH_BUCKET, BENCH_KEY, "", len(body))
+
+    def run():
+        util.parse_object(
+            obj, [generator.CREATE_PLAYER_EVENT,
+                  generator.PLAYER_LOGIN_EVENT],
+            [generator.IAP_EVENT])
+    return run, len(data.lines)
+
+
+class MemoryClient():
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+def prepare_add_player_id(data, backend):
+    logs = data.logs[generator.PLAYER_LOGIN_EVENT]
+
+    def run():
+        for players in (set(), {}, BACKENDS["set"](None)):
+            for log in logs:
+                util.add_player_id(players, log)
+    return run, len(logs) * 3
+
+
+def prepare_put(data, backend):
+    logs = data.logs[generator.PLAYER_LOGIN_EVENT]
+    players = [(util.get_local_time_str(log["time"]), util.get_platform(log),
+                util.get_channel(log), log["player_id"]) for log in logs]
+
+    def run():
+        player_map = BACKENDS[backend](PlayerIdInterner())
+        for time_str, platform, channel, player_id in players:
+            player_map.put(time_str, platform, channel, player_id)
+        return player_map.get_days(), player_map.size()
+    return run, len(players)
+
+
+def prepare_views(data, backend):
+    _, login_map = data.get_maps(backend)
+    channels = get_channels(login_map)
+
+    def run():
+        login_map.views = {}
+        ret = {}
+        total_player_ids = login_map.get_total_player_ids()
+        for platform, channel_ids in total_player_ids.items():
+            for channel, player_ids in channel_ids.items():
+                ret[(platform, channel)] = len(player_ids)
+        login_map.get_total_player_ids_counter()
+        for platform, channel in channels:
+            player_ids, _ = login_map.get_all_day_player_ids(
+                platform, channel)
+            ret[(platform, channel, "all_day")] = len(player_ids)
+            login_map.get_all_day_player_ids_counter(platform, channel)
+        return ret
+    return run, login_map.size()
+
+
+def get_channels(player_map):
+    return [(platform, channel)
+            for platform, channels in player_map.player_id_map.items()
+            for channel in channels]
+
+
+def prepare_retention(data, backend):
+    module = get_module("retention-count")
+    create_map, login_map = data.get_maps(backend)
+
+    def run():
+        reset_views(create_map, login_map)
+        return module.compute_retention_count(login_map, create_map)
+    return run, create_map.size() + login_map.size()
+
+
+# 前一半日期登录过的不算回流，流失后在后一半日期登录的算回流
+def prepare_returning(data, backend):
+    module = get_module("retention-count")
+    create_map, login_map = data.get_maps(backend)
+    days = sorted(login_map.get_days())
+    first_days = set(days[:len(days) // 2])
+    first_login_map = data.new_map(backend)
+    second_login_map = data.new_map(backend)
+    for platform, channels in login_map.player_id_map.items():
+        for channel, login_days in channels.items():
+            for day, player_ids in login_days.items():
+                if day in first_days:
+                    first_login_map.put_ids(day, platform, channel, player_ids)
+                else:
+                    second_login_map.put_ids(
+                        day, platform, channel, player_ids)
+
+    def run():
+        reset_views(create_map, first_login_map, second_login_map)
+        return module.compute_returning_count(
+            create_map, first_login_map, second_login_map)
+    return run, create_map.size() + login_map.size()
+
+
+def prepare_churn(data, backend):
+    module = get_module("retention-effective-count")
+    create_map, login_map = data.get_maps(backend)
+    login_days = login_map.get_days()
+
+    def run():
+        reset_views(create_map, login_map)
+        return module.compute_churn_rate(
+            create_map.get_total_player_ids(), login_map, login_days)
+    return run, create_map.size() + login_map.size()
+
+
+def reset_views(*player_maps):
+    for player_map in player_maps:
+        player_map.views = {}
+
+
+def prepare_es_doc(data, backend):
+    module = get_module("paying-users")
+    logs = data.logs[generator.IAP_EVENT]
+    time_str = util.get_local_time_str(data.start_time)
+
+    def run():
+        # 批次足够大，只序列化不发送
+        writer = es.BulkWriter(
+            bulk_size=len(logs) + 1, bulk_bytes=float("inf"))
+        for log in logs:
+            doc_id = util.get_paying_users_index_id(
+                log["player_id"], log["platform"], log["channel"])
+            writer.add(BENCH_INDEX, doc_id, module.es_get_doc(time_str, log))
+        writer.buffers.clear()
+    return run, len(logs)
+
+
+def get_module(name):
+    module = importlib.import_module(name)
+    init_logger()
+    return module
+
+
+# 用例名 -> (prepare, 是否按PlayerIdMap后端分别执行)
+CASES = {
+    "get_log": (prepare_get_log, False),
+    "get_player_id": (prepare_get_player_id, False),
+    "parse_object": (prepare_parse_object, False),
+    "add_player_id": (prepare_add_player_id, False),
+    "put": (prepare_put, True),
+    "views": (prepare_views, True),
+    "retention": (prepare_retention, True),
+    "returning": (prepare_returning, True),
+    "churn": (prepare_churn, True),
+    "es_doc": (prepare_es_doc, False)
+}
+
+
+if __name__ == '__main__':
+    sys.exit(arg_parse(*sys.argv))
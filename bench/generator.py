@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import json
+import random
+
+CREATE_PLAYER_EVENT = "CreatePlayer"
+PLAYER_LOGIN_EVENT = "EnterGame"
+IAP_EVENT = "IAP"
+# 每行的事件按权重随机，登录日志最多
+EVENT_WEIGHTS = {
+    CREATE_PLAYER_EVENT: 1,
+    PLAYER_LOGIN_EVENT: 8,
+    IAP_EVENT: 1
+}
+PLATFORMS = ("ios", "android")
+CHANNELS = ("appstore", "googleplay", "huawei", "xiaomi")
+PRODUCTS = (("gem_60", 0.99), ("gem_300", 4.99), ("gem_980", 14.99))
+DEFAULT_SEED = 20190529
+# README中日志的时间
+START_TIME = 1559111639
+ONE_DAY = 86400
+# 平均每个玩家的日志行数
+LINES_PER_PLAYER = 20
+
+
+# 同样的size和seed生成同样的日志，时间按行递增
+# log format:time event json obj
+def generate_lines(size, days=7, seed=DEFAULT_SEED):
+    rnd = random.Random(seed)
+    events = list(EVENT_WEIGHTS)
+    weights = list(EVENT_WEIGHTS.values())
+    player_size = max(size // LINES_PER_PLAYER, 1)
+    interval = days * ONE_DAY / max(size, 1)
+    for i in range(size):
+        event = rnd.choices(events, weights)[0]
+        player_id = rnd.randrange(player_size)
+        log_time = START_TIME + int(i * interval)
+        obj = get_log_obj(rnd, event, player_id)
+        yield (str(log_time) + " " + event + " " +
+               json.dumps(obj, separators=(",", ":"), ensure_ascii=False) +
+               "\n")
+
+
+# 玩家的平台和渠道是固定的
+def get_log_obj(rnd, event, player_id):
+    obj = {
+        "player_id": str(player_id),
+        "platform": PLATFORMS[player_id % len(PLATFORMS)],
+        "channel": CHANNELS[player_id // len(PLATFORMS) % len(CHANNELS)]
+    }
+    if event == CREATE_PLAYER_EVENT:
+        obj["avatar_id"] = 100000 + player_id % 8
+        obj["name"] = "玩家" + str(player_id)
+    elif event == IAP_EVENT:
+        product_id, price = PRODUCTS[rnd.randrange(len(PRODUCTS))]
+        obj["product_id"] = product_id
+        obj["price"] = price
+    return obj
+
+
+def get_time_range(days=7):
+    return START_TIME, START_TIME + days * ONE_DAY
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+from eslog import eslog
+from util import util
+from s3 import s3
+from objindex import objindex
+
+ES_INDEX = os.getenv("ES_INDEX", "retention")
+S3_KEY_PREFIX_CREATE_PLAYER = os.getenv("S3_KEY_PREFIX_CREATE_PLAYER")
+S3_KEY_PREFIX_PLAYER_LOGIN = os.getenv("S3_KEY_PREFIX_PLAYER_LOGIN")
+# 默认为创建角色和登录日志的前缀建立索引
+OBJECT_INDEX_PREFIXS = os.getenv("OBJECT_INDEX_PREFIXS", ",".join([
+    S3_KEY_PREFIX_CREATE_PLAYER or "", S3_KEY_PREFIX_PLAYER_LOGIN or ""]))
+
+COMMA = ","
+
+logger = eslog.get_logger(ES_INDEX)
+
+
+def arg_parse(*args, **kwargs):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d", "--day",
+        nargs="?",
+        const=util.get_yesterday(),
+        type=util.valid_date,
+        default=util.get_yesterday(),
+        help="Date. The default date is yesterday. The format is YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=util.valid_date,
+        help="Start date. The format is YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        type=util.valid_date,
+        default=util.get_yesterday(),
+        help="End date. The default date is yesterday. "
+        "The format is YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "-p", "--prefixs",
+        default=OBJECT_INDEX_PREFIXS,
+        help="S3 key prefixs, separated by comma. "
+        "The default is OBJECT_INDEX_PREFIXS"
+    )
+    args = parser.parse_args()
+    time_strs = [args.day]
+    if args.start is not None:
+        time_strs = util.get_date_list(args.start, args.end)
+    build(time_strs, args.prefixs.split(COMMA))
+
+
+def valid_params(time_strs, s3_key_prefixs):
+    if not objindex.is_enabled():
+        logger.error("Params error. OBJECT_INDEX_DIR is empty")
+        raise RuntimeError()
+    if len(time_strs) == 0:
+        logger.error("Params error. no date to build")
+        raise RuntimeError()
+    if len(s3_key_prefixs) == 0:
+        logger.error("Params error. no s3 key prefix to build")
+        raise RuntimeError()
+
+
+# 只读取还没有索引或者已经改变的对象
+def build(time_strs, s3_key_prefixs):
+    s3_key_prefixs = [
+        prefix.strip() for prefix in s3_key_prefixs
+        if not util.is_empty(prefix)]
+    valid_params(time_strs, s3_key_prefixs)
+    bucket = s3.init_bucket_from_env()
+    for time_str in time_strs:
+        day = util.get_days_with_today(time_str)
+        for s3_key_prefix in s3_key_prefixs:
+            for filter_prefix in util.get_date_paths(s3_key_prefix, day):
+                build_prefix(bucket, filter_prefix)
+        objindex.save()
+    logger.info("Build index end.")
+
+
+def build_prefix(bucket, filter_prefix):
+    objs = util.list_objects(bucket, filter_prefix)
+    missing = [obj for obj in objs if objindex.get(obj) is None]
+    util.map_objects(index_object, missing)
+    logger.info(
+        f"Build index. prefix: {filter_prefix} ."
+        f"object size: {len(objs)} ."
+        f"build size: {len(missing)}")
+
+
+def index_object(obj):
+    entry = objindex.new_entry(obj)
+    for line in util.read_lines(obj):
+        objindex.add_line(entry, util.split_line(line))
+    objindex.record(obj, entry)
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(arg_parse(*sys.argv))
+    except KeyboardInterrupt:
+        logger.exception("CTL-C Pressed.")
+        exit("CTL-C Pressed.")
+    except Exception as e:
+        logger.exception(e)
+        exit("Exception")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import os
+import pickle
+import threading
+
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR")
+PARSE_CACHE_MAX_BYTES = int(
+    os.getenv("PARSE_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# 超出上限后淘汰到上限的比例，避免每次写入都淘汰
+PARSE_CACHE_EVICT_RATIO = 0.9
+PARSE_CACHE_SUFFIX = ".pickle"
+
+logger = logging.getLogger()
+
+cache_bytes = None
+cache_lock = threading.Lock()
+
+
+def is_enabled():
+    return bool(PARSE_CACHE_DIR and PARSE_CACHE_DIR.strip())
+
+
+def get_path(name):
+    file_name = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return os.path.join(PARSE_CACHE_DIR, file_name + PARSE_CACHE_SUFFIX)
+
+
+def get(name):
+    if not is_enabled():
+        return None
+    path = get_path(name)
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+        # 更新修改时间，淘汰时按修改时间排序(LRU)
+        os.utime(path)
+        return value
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.warn(f"Read cache error. name: {name} . error: {e}")
+        remove(path)
+        return None
+
+
+def put(name, value):
+    if not is_enabled():
+        return
+    global cache_bytes
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    path = get_path(name)
+    tmp_path = (path + "." + str(os.getpid()) + "." +
+                str(threading.get_ident()))
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with cache_lock:
+        if cache_bytes is None:
+            cache_bytes = get_total_bytes()
+        old_size = get_size(path)
+        os.replace(tmp_path, path)
+        cache_bytes = cache_bytes + get_size(path) - old_size
+        if cache_bytes > PARSE_CACHE_MAX_BYTES:
+            evict()
+
+
+def evict():
+    global cache_bytes
+    files = get_files()
+    total = sum(size for _, _, size in files)
+    limit = PARSE_CACHE_MAX_BYTES * PARSE_CACHE_EVICT_RATIO
+    count = 0
+    for _, path, size in sorted(files):
+        if total <= limit:
+            break
+        if remove(path):
+            total = total - size
+            count = count + 1
+    cache_bytes = total
+    logger.info(f"Evict cache. file count: {count} . cache bytes: {total}")
+
+
+def get_files():
+    ret = []
+    for entry in os.scandir(PARSE_CACHE_DIR):
+        if not entry.name.endswith(PARSE_CACHE_SUFFIX):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        ret.append((stat.st_mtime, entry.path, stat.st_size))
+    return ret
+
+
+def get_total_bytes():
+    return sum(size for _, _, size in get_files())
+
+
+def get_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
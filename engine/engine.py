@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+import logging
+
+from util import util
+from model import new_player_id_map
+from snapshot import snapshot
+from objindex import objindex
+
+logger = logging.getLogger()
+
+
+# inputs: (kind, event, s3_key_prefix, time_str)
+# 所有任务需要的(event, day)合并后，每个s3对象只下载解析一次
+def load(bucket, inputs):
+    sources = get_sources(inputs)
+    if len(sources) == 0:
+        return
+    prefix_sources, day_prefixs = get_prefix_sources(sources)
+    objects, exist_prefixs = list_objects(bucket, prefix_sources)
+    prune_objects(objects, sources)
+    collectors = get_collectors(sources)
+    log_objs, groups = get_object_groups(objects, sources)
+    parsed = util.map_objects(read_object, log_objs, objects, sources)
+    for obj, (summary, logs) in zip(log_objs, parsed):
+        add_object(summary, logs, objects[obj.key][1], sources, collectors)
+    for obj_sources, objs in groups.items():
+        events = {source[0] for source in obj_sources}
+        days = get_event_days(obj_sources, sources)
+        summary = util.get_players_summary(objs, events, days)
+        add_object(summary, {}, obj_sources, sources, collectors)
+    objindex.save()
+    preload(collectors, day_prefixs, exist_prefixs)
+    logger.info(
+        f"Engine load end. object size: {len(objects)} ."
+        f"input size: {len(collectors)}")
+
+
+# (event, s3_key_prefix) -> {time_str: set(kind)}
+def get_sources(inputs):
+    ret = {}
+    for kind, event, s3_key_prefix, time_str in inputs:
+        preloaded = get_preloaded(kind)
+        if (event, s3_key_prefix, time_str) in preloaded:
+            continue
+        if kind == util.INPUT_PLAYERS and load_snapshot(
+                event, s3_key_prefix, time_str):
+            continue
+        days = ret.setdefault((event, s3_key_prefix), {})
+        days.setdefault(time_str, set()).add(kind)
+    return ret
+
+
+# 已经结束的一天直接读取快照，不再扫描s3
+def load_snapshot(event, s3_key_prefix, time_str):
+    player_map = snapshot.load(event, s3_key_prefix, time_str)
+    if player_map is None:
+        return False
+    util.preloaded_players[(event, s3_key_prefix, time_str)] = (
+        player_map, True)
+    return True
+
+
+def evict(inputs):
+    for kind, event, s3_key_prefix, time_str in inputs:
+        get_preloaded(kind).pop((event, s3_key_prefix, time_str), None)
+
+
+def get_preloaded(kind):
+    if kind == util.INPUT_LOGS:
+        return util.preloaded_logs
+    return util.preloaded_players
+
+
+def get_prefix_sources(sources):
+    prefix_sources = {}
+    day_prefixs = {}
+    for source, days in sources.items():
+        for time_str in days:
+            day = util.get_days_with_today(time_str)
+            filter_prefixs = util.get_date_paths(source[1], day)
+            day_prefixs[source + (time_str,)] = filter_prefixs
+            for filter_prefix in filter_prefixs:
+                prefix_sources.setdefault(filter_prefix, set()).add(source)
+    return prefix_sources, day_prefixs
+
+
+# 不同的前缀可能对应同一个对象，按key去重
+def list_objects(bucket, prefix_sources):
+    objects = {}
+    exist_prefixs = set()
+    for filter_prefix, sources in prefix_sources.items():
+        for obj in util.list_objects(bucket, filter_prefix):
+            exist_prefixs.add(filter_prefix)
+            if obj.key not in objects:
+                objects[obj.key] = (obj, set())
+            objects[obj.key][1].update(sources)
+    for filter_prefix in prefix_sources:
+        if filter_prefix not in exist_prefixs:
+            logger.warn(f"File not exist. file name: {filter_prefix} .")
+    return objects, exist_prefixs
+
+
+# 按对象索引去掉对象不可能包含的来源，没有来源的对象不再读取
+def prune_objects(objects, sources):
+    if not objindex.is_enabled():
+        return
+    windows = get_windows(sources)
+    size = len(objects)
+    for key, (obj, obj_sources) in list(objects.items()):
+        obj_sources = {
+            source for source in obj_sources
+            if objindex.may_contain(obj, source[0], windows[source])}
+        if len(obj_sources) == 0:
+            del objects[key]
+        else:
+            objects[key] = (obj, obj_sources)
+    if len(objects) < size:
+        logger.info(
+            f"Skip objects by index. object size: {size} ."
+            f"skip size: {size - len(objects)}")
+
+
+def get_windows(sources):
+    ret = {}
+    for source, days in sources.items():
+        ret[source] = [
+            (util.get_start_timestamp_time_str(time_str),
+             util.get_end_timestamp_time_str(time_str))
+            for time_str in days]
+    return ret
+
+
+def get_collectors(sources):
+    ret = {}
+    for source, days in sources.items():
+        for time_str, kinds in days.items():
+            for kind in kinds:
+                if kind == util.INPUT_LOGS:
+                    ret[(kind,) + source + (time_str,)] = []
+                else:
+                    ret[(kind,) + source + (time_str,)] = new_player_id_map()
+    return ret
+
+
+# 需要明细日志的对象单独解析，只需要玩家id的对象按来源分组合并解析
+def get_object_groups(objects, sources):
+    log_objs = []
+    groups = {}
+    for obj, obj_sources in objects.values():
+        if len(get_events(obj_sources, sources, util.INPUT_LOGS)) > 0:
+            log_objs.append(obj)
+        else:
+            groups.setdefault(frozenset(obj_sources), []).append(obj)
+    return log_objs, groups
+
+
+def get_events(obj_sources, sources, kind):
+    ret = set()
+    for source in obj_sources:
+        for kinds in sources[source].values():
+            if kind in kinds:
+                ret.add(source[0])
+    return ret
+
+
+def get_event_days(obj_sources, sources):
+    ret = {}
+    for source in obj_sources:
+        ret.setdefault(source[0], set()).update(sources[source])
+    return ret
+
+
+# 同一个对象既要明细日志又要玩家id时，只读取一次
+def read_object(obj, objects, sources):
+    obj_sources = objects[obj.key][1]
+    player_events = get_events(obj_sources, sources, util.INPUT_PLAYERS)
+    log_events = get_events(obj_sources, sources, util.INPUT_LOGS)
+    time_strs = set()
+    for days in get_event_days(obj_sources, sources).values():
+        time_strs.update(days)
+    summary, logs = util.parse_object(
+        obj, player_events, log_events, util.get_parse_window(time_strs))
+    util.save_object_summary(obj, summary)
+    return summary, logs
+
+
+def add_object(summary, logs, obj_sources, sources, collectors):
+    for source in obj_sources:
+        days = sources[source]
+        if source[0] in summary:
+            add_summary(summary[source[0]], source, days, collectors)
+        if source[0] in logs:
+            add_logs(logs[source[0]], source, days, collectors)
+
+
+def add_summary(event_summary, source, days, collectors):
+    for (day, platform, channel), player_ids in event_summary.items():
+        if util.INPUT_PLAYERS not in days.get(day, ()):
+            continue
+        collector = collectors[(util.INPUT_PLAYERS,) + source + (day,)]
+        collector.put_ids(day, platform, channel, player_ids)
+
+
+def add_logs(logs, source, days, collectors):
+    for log in logs:
+        day = util.get_local_time_str(log["time"])
+        if util.INPUT_LOGS not in days.get(day, ()):
+            continue
+        collectors[(util.INPUT_LOGS,) + source + (day,)].append(log)
+
+
+def preload(collectors, day_prefixs, exist_prefixs):
+    for key, collector in collectors.items():
+        kind = key[0]
+        filter_prefixs = day_prefixs[key[1:]]
+        exist = len(exist_prefixs.intersection(filter_prefixs)) > 0
+        get_preloaded(kind)[key[1:]] = (collector, exist)
+        if kind == util.INPUT_PLAYERS and exist:
+            snapshot.save(
+                key[1], key[2], key[3], collector,
+                util.get_end_timestamp_time_str(key[3]))
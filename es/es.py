@@ -2,8 +2,12 @@
 import logging
 import requests
 import os
+import queue
+import threading
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from requests.packages.urllib3.util.retry import Retry
 from util import util
 import json
 
@@ -13,23 +17,93 @@ ES_USER = os.getenv("ES_USER")
 ES_PWD = os.getenv("ES_PWD")
 ES_URL = os.getenv("ES_URL")
 
-ES_BULK_SIZE = 1000
+ES_POOL_SIZE = int(os.getenv("ES_POOL_SIZE", 10))
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", 3))
+ES_RETRY_BACKOFF = float(os.getenv("ES_RETRY_BACKOFF", 0.5))
+ES_RETRY_STATUS = [429, 500, 502, 503, 504]
+# 只有幂等的请求按状态码和读超时重试
+ES_RETRY_METHODS = frozenset(["GET", "PUT", "DELETE"])
+# _bulk和scroll的POST不是幂等的，只在确定没有被处理时重试
+ES_POST_METHOD = "POST"
+ES_POST_RETRY_STATUS = frozenset([429])
+
+ES_BULK_SIZE = int(os.getenv("ES_BULK_SIZE", 1000))
+ES_BULK_BYTES = int(os.getenv("ES_BULK_BYTES", 5 * 1024 * 1024))
 ES_NEWLINE = "\n"
 
+ES_SCROLL_TIME = "2m"
+ES_SCROLL_SLICES = int(os.getenv("ES_SCROLL_SLICES", 1))
+ES_TERMS_SIZE = int(os.getenv("ES_TERMS_SIZE", 1000))
+
 es_json_headers = {"Content-Type": "application/json"}
 es_x_ndjson_headers = {"Content-Type": "application/x-ndjson"}
 es_auth = HTTPBasicAuth(ES_USER, ES_PWD)
 
 logger = logging.getLogger()
 
+# (index, field, source_fields) -> {value: _source}，没有文档的value为None
+terms_cache = {}
+
+
+class ESRetry(Retry):
+    # 连接失败时请求还没有发出，urllib3对所有方法都会重试
+    # POST只在429(请求被拒绝，没有处理)时按状态码重试
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == ES_POST_METHOD:
+            return status_code in ES_POST_RETRY_STATUS
+        return Retry.is_retry(self, method, status_code, has_retry_after)
+
+
+# urllib3 1.26以前是method_whitelist
+def get_retry():
+    kwargs = {
+        "total": ES_MAX_RETRIES,
+        "backoff_factor": ES_RETRY_BACKOFF,
+        "status_forcelist": ES_RETRY_STATUS,
+        "raise_on_status": False
+    }
+    try:
+        return ESRetry(allowed_methods=ES_RETRY_METHODS, **kwargs)
+    except TypeError:
+        return ESRetry(method_whitelist=ES_RETRY_METHODS, **kwargs)
+
+
+# 所有请求共用连接池，keep-alive，429和5xx按指数退避重试
+# POST只重试连接失败和429
+def new_session():
+    adapter = HTTPAdapter(
+        pool_connections=ES_POOL_SIZE, pool_maxsize=ES_POOL_SIZE,
+        max_retries=get_retry())
+    ret = requests.Session()
+    ret.mount("http://", adapter)
+    ret.mount("https://", adapter)
+    ret.auth = es_auth
+    ret.verify = False
+    return ret
+
+
+session = None
+session_pid = None
+session_lock = threading.Lock()
+
+
+# fork出的子进程不能使用父进程连接池中的连接，多个进程会写同一个socket
+def get_session():
+    global session, session_pid
+    with session_lock:
+        if session is None or session_pid != os.getpid():
+            session = new_session()
+            session_pid = os.getpid()
+        return session
+
 
 def add_doc(path, data):
     url = get_base_url()
     if ES_URL != "/" and ES_URL.endswith("/"):
         url = ES_URL[:-1]
     url = url + "/" + path
-    response = requests.put(url, headers=es_json_headers, timeout=10,
-                            data=data, verify=False, auth=es_auth)
+    response = get_session().put(
+        url, headers=es_json_headers, timeout=10, data=data)
     if (response.status_code != requests.codes.ok and
             response.status_code != requests.codes.created):
         http_error_log(url, response)
@@ -40,67 +114,243 @@ def add_doc(path, data):
 def batch_add_doc(index, data):
     url = get_base_url()
     url = url + "/" + index + "/_doc/_bulk"
-    response = requests.post(url, headers=es_x_ndjson_headers, timeout=60,
-                             data=data, verify=False, auth=es_auth)
+    response = get_session().post(
+        url, headers=es_x_ndjson_headers, timeout=60, data=data)
     if (response.status_code != requests.codes.ok and
             response.status_code != requests.codes.created):
         http_error_log(url, response)
         raise requests.HTTPError(response)
     logger.info(f"Add docs success. url: {url}")
+    return response.json()
+
+
+def get_bulk_failures(index, result):
+    ret = []
+    if not result.get("errors"):
+        return ret
+    for item in result.get("items", []):
+        for action, value in item.items():
+            if value.get("status", 0) >= 300:
+                ret.append((index, value.get("_id"), value.get("status"),
+                            value.get("error")))
+    return ret
+
+
+class BulkWriter():
+    # 按文档数和字节数分批写入_bulk，每批单独拼接，不会生成整个请求体
+    def __init__(self, bulk_size=ES_BULK_SIZE, bulk_bytes=ES_BULK_BYTES):
+        self.bulk_size = bulk_size
+        self.bulk_bytes = bulk_bytes
+        self.buffers = {}
+        self.failures = []
+        self.count = 0
+
+    def add_all(self, docs):
+        for index, doc_id, source in docs:
+            self.add(index, doc_id, source)
+
+    def add(self, index, doc_id, source):
+        if not isinstance(source, str):
+            source = json.dumps(source)
+        action = {"index": {}}
+        if doc_id is not None:
+            action["index"]["_id"] = doc_id
+        line = (json.dumps(action) + ES_NEWLINE + source + ES_NEWLINE).encode(
+            "utf-8")
+        buffer = self.buffers.setdefault(index, [[], 0])
+        if (len(buffer[0]) > 0 and
+                buffer[1] + len(line) > self.bulk_bytes):
+            self.flush(index)
+            buffer = self.buffers.setdefault(index, [[], 0])
+        buffer[0].append(line)
+        buffer[1] = buffer[1] + len(line)
+        if len(buffer[0]) >= self.bulk_size:
+            self.flush(index)
+
+    def flush(self, index=None):
+        indexes = [index] if index is not None else list(self.buffers)
+        for name in indexes:
+            buffer = self.buffers.pop(name, None)
+            if buffer is None or len(buffer[0]) == 0:
+                continue
+            result = batch_add_doc(name, b"".join(buffer[0]))
+            failures = get_bulk_failures(name, result)
+            for failure in failures:
+                logger.error(
+                    f"Add doc failed. index: {failure[0]} ."
+                    f"id: {failure[1]} . status: {failure[2]} ."
+                    f"error: {failure[3]}")
+            self.failures.extend(failures)
+            self.count = self.count + len(buffer[0])
+
+    def close(self):
+        self.flush()
+        logger.info(
+            f"Bulk write end. doc size: {self.count} ."
+            f"failed size: {len(self.failures)}")
+        if len(self.failures) > 0:
+            raise RuntimeError(
+                f"Bulk write failed. failed size: {len(self.failures)}")
 
 
 def query_match_all(index, data):
     ret = []
+    for hits in scroll_pages(index, data):
+        ret.extend(hits)
+    return ret
+
+
+# 按页返回命中的文档，slices大于1时多个切片并发scroll，页的顺序不固定
+def scroll_pages(index, data, slices=None):
+    if slices is None:
+        slices = ES_SCROLL_SLICES
+    if slices <= 1:
+        yield from scroll_slice(index, data)
+        return
+    pages = queue.Queue(maxsize=slices * 2)
+    stop = threading.Event()
+    threads = []
+    for slice_id in range(slices):
+        thread = threading.Thread(
+            target=put_slice_pages, daemon=True,
+            args=(pages, stop, index, get_slice_data(data, slice_id, slices)))
+        thread.start()
+        threads.append(thread)
+    try:
+        done = 0
+        while done < slices:
+            page = pages.get()
+            if page is None:
+                done = done + 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def get_slice_data(data, slice_id, slices):
+    data = json.loads(data)
+    data["slice"] = {"id": slice_id, "max": slices}
+    return json.dumps(data)
+
+
+# 切片结束时放入None，出错时放入异常
+def put_slice_pages(pages, stop, index, data):
+    try:
+        for hits in scroll_slice(index, data):
+            if not put_page(pages, stop, hits):
+                return
+        put_page(pages, stop, None)
+    except Exception as e:
+        put_page(pages, stop, e)
+
+
+# 调用方提前结束时不再阻塞
+def put_page(pages, stop, page):
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def scroll_slice(index, data):
+    hits, scroll_id = search_scroll(index, data)
+    try:
+        while hits:
+            yield hits
+            hits, scroll_id = get_next(scroll_id)
+    finally:
+        if scroll_id is not None:
+            del_scroll(scroll_id)
+
+
+# 按field的值分批terms查询，同一个index查询过的值不再查询
+# text类型的字段分词后terms查不到，terms_field可以指定keyword子字段
+def get_sources_by_terms(index, field, values, source_fields,
+                         terms_field=None):
+    if terms_field is None:
+        terms_field = field
+    cache = terms_cache.setdefault(
+        (index, terms_field, tuple(source_fields)), {})
+    missing = sorted(set(values).difference(cache))
+    logger.info(
+        f"Query by terms. index: {index} . field: {terms_field} ."
+        f"missing size: {len(missing)}")
+    for start in range(0, len(missing), ES_TERMS_SIZE):
+        batch = missing[start:start + ES_TERMS_SIZE]
+        cache.update(dict.fromkeys(batch))
+        data = get_terms_dsl(terms_field, batch, source_fields)
+        for hits in scroll_pages(index, data, slices=1):
+            for hit in hits:
+                source = hit["_source"]
+                for value in get_scalar_values(
+                        get_source_field(source, field)):
+                    cache[value] = source
+    ret = {}
+    for value in values:
+        source = cache.get(value)
+        if source is not None:
+            ret[value] = source
+    return ret
+
+
+# 字段不存在时返回None
+def get_source_field(source, field):
+    for name in field.split("."):
+        if not isinstance(source, dict):
+            return None
+        source = source.get(name)
+    return source
+
+
+# 数组字段的每个值分别对应这个文档，缺失的和对象类型的值忽略
+def get_scalar_values(value):
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if isinstance(v, (str, int, float))]
+
+
+def search_scroll(index, data):
     url = get_base_url()
-    url = url + "/" + index + "/_search?scroll=2m"
-    response = requests.post(url, headers=es_json_headers, timeout=60,
-                             data=data, verify=False, auth=es_auth)
+    url = url + "/" + index + "/_search?scroll=" + ES_SCROLL_TIME
+    response = get_session().post(
+        url, headers=es_json_headers, timeout=60, data=data)
     if response.status_code != requests.codes.ok:
         http_error_log(url, response)
         if response.status_code == requests.codes.not_found:
-            return ret
+            return None, None
         else:
             raise requests.HTTPError(response)
     logger.info(f"Query success. url: {url}, request param is {data}")
-    hits, scroll_id = get_hits(response)
-    has_more = True
-    if hits:
-        ret.extend(hits)
-    else:
-        has_more = False
-
-    while(has_more):
-        has_more, scroll_id = get_next(ret, scroll_id)
-    del_scroll(scroll_id)
-    return ret
+    return get_hits(response)
 
 
-def get_next(ret, scroll_id):
+def get_next(scroll_id):
     url = get_base_url()
-    url = url + "/_search/scroll?scroll=2m"
+    url = url + "/_search/scroll?scroll=" + ES_SCROLL_TIME
     data = get_scroll_data(scroll_id)
-    response = requests.post(url, headers=es_json_headers, timeout=60,
-                             data=data, verify=False, auth=es_auth)
+    response = get_session().post(
+        url, headers=es_json_headers, timeout=60, data=data)
     if (response.status_code != requests.codes.ok and
             response.status_code != requests.codes.created):
         http_error_log(url, response)
         raise requests.HTTPError(response)
     logger.info(f"Get next success. url: {url}, scroll_id is {scroll_id}")
-    hits, scroll_id = get_hits(response)
-    if hits:
-        ret.extend(hits)
-        return True, scroll_id
-    else:
-        return False, scroll_id
+    return get_hits(response)
 
 
 def del_scroll(scroll_id):
     url = get_base_url()
     url = url + "/_search/scroll"
     data = get_scroll_data(scroll_id)
-    response = requests.delete(
-        url, headers=es_json_headers, timeout=60, data=data, verify=False,
-        auth=es_auth)
+    response = get_session().delete(
+        url, headers=es_json_headers, timeout=60, data=data)
     if (response.status_code != requests.codes.ok and
             response.status_code != requests.codes.created):
         http_error_log(url, response)
@@ -147,6 +397,50 @@ def http_error_log(url, response):
         f"Http content:{response.content}")
 
 
+# 只返回_id和毫秒时间戳，timestamp不为空时只查询之后的文档
+def get_ids_dsl(size=1000, timestamp=None):
+    query = {"match_all": {}}
+    if timestamp is not None:
+        query = {
+            "range": {
+                "@timestamp": {"gte": timestamp, "format": "epoch_millis"}
+            }
+        }
+    data = {
+        "query": query,
+        "_source": False,
+        "docvalue_fields": [
+            {"field": "@timestamp", "format": "epoch_millis"}
+        ],
+        "sort": [
+            "_doc"
+        ],
+        "size": size
+    }
+    return json.dumps(data)
+
+
+def get_doc_timestamp(hit):
+    values = hit.get("fields", {}).get("@timestamp")
+    if not values:
+        return None
+    return int(float(values[0]))
+
+
+def get_terms_dsl(field, values, source_fields, size=1000):
+    data = {
+        "query": {
+            "terms": {field: values}
+        },
+        "_source": source_fields,
+        "sort": [
+            "_doc"
+        ],
+        "size": size
+    }
+    return json.dumps(data)
+
+
 def get_match_all_dsl(size=1000):
     data = {
         "query": {
@@ -3,41 +3,59 @@ from datetime import datetime
 import logging
 from es import es
 import json
+import os
+import queue
+import sys
+import threading
+import time
 import uuid
 
 format = "%(asctime)s: %(levelname)s:%(module)s: %(funcName)s: %(message)s"
 
+# 异步模式在后台线程按条数或时间分批写入es，队列满时丢弃日志并计数
+ESLOG_ASYNC = os.getenv("ESLOG_ASYNC", "false").lower() in ("1", "true")
+ESLOG_QUEUE_SIZE = int(os.getenv("ESLOG_QUEUE_SIZE", 10000))
+ESLOG_FLUSH_SIZE = int(os.getenv("ESLOG_FLUSH_SIZE", 500))
+ESLOG_FLUSH_INTERVAL = float(os.getenv("ESLOG_FLUSH_INTERVAL", 5))
+# close时放入队列，后台线程写完之前的日志后立即退出
+ESLOG_STOP = object()
+
 
 def get_logger(index_name):
     index_name = index_name + "-logs"
     logger = logging.getLogger()
     logging.basicConfig(format=format)
-    handler = ESLogHandler(index_name)
+    # 同一进程内多个脚本共用一个handler
+    for handler in logger.handlers:
+        if (isinstance(handler, (ESLogHandler, AsyncESLogHandler)) and
+                handler.index_name == index_name):
+            return logger
+    if ESLOG_ASYNC:
+        handler = AsyncESLogHandler(index_name)
+    else:
+        handler = ESLogHandler(index_name)
     logger.addHandler(handler)
     logger.setLevel(logging.INFO)
     return logger
 
 
+def get_es_datetime_str(timestamp):
+    current_date = datetime.utcfromtimestamp(timestamp)
+    return "{0!s}.{1:03d}Z".format(current_date.strftime(
+        '%Y-%m-%dT%H:%M:%S'), int(current_date.microsecond / 1000))
+
+
 class ESLogHandler(logging.Handler):
     def __init__(self, index_name, level=logging.NOTSET, enable_to_es=True):
         logging.Handler.__init__(self, level=level)
         self.to_es_logs = []
         self.index_name = index_name
         self.batches = str(uuid.uuid4())
+        self.pid = os.getpid()
 
-    @staticmethod
-    def __get_es_datetime_str(timestamp):
-        current_date = datetime.utcfromtimestamp(timestamp)
-        return "{0!s}.{1:03d}Z".format(current_date.strftime(
-            '%Y-%m-%dT%H:%M:%S'), int(current_date.microsecond / 1000))
-
-    def emit(self, record):
-        action = {
-            "index": {}
-        }
-        ret = json.dumps(action) + es.ES_NEWLINE
+    def get_source(self, record):
         source = dict()
-        source["@timestamp"] = self.__get_es_datetime_str(record.created)
+        source["@timestamp"] = get_es_datetime_str(record.created)
         source["level"] = record.levelname
         source["name"] = record.name
         source["lineno"] = record.lineno
@@ -45,11 +63,26 @@ class ESLogHandler(logging.Handler):
         source["module"] = record.module
         source["batches"] = self.batches
         source["funcName"] = record.funcName
+        return source
+
+    # fork出的子进程只写自己的日志，之前的日志由父进程写入
+    def check_pid(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.to_es_logs = []
+
+    def emit(self, record):
+        self.check_pid()
+        action = {
+            "index": {}
+        }
+        ret = json.dumps(action) + es.ES_NEWLINE
+        source = self.get_source(record)
         ret = ret + json.dumps(source) + es.ES_NEWLINE
         self.to_es_logs.append(ret)
 
-    def output_to_es(self):
-        size = len(self.to_es_logs)
+    def output_to_es(self, to_es_logs):
+        size = len(to_es_logs)
         if size == 0:
             return
         start = 0
@@ -60,7 +93,113 @@ class ESLogHandler(logging.Handler):
             if end >= size:
                 end = size
             es.batch_add_doc(
-                self.index_name, "".join(self.to_es_logs[start: end]))
+                self.index_name, "".join(to_es_logs[start: end]))
+
+    # 先在锁内取出缓冲区再写入，写入时产生的日志留到下次
+    def flush(self):
+        with self.lock:
+            self.check_pid()
+            to_es_logs = self.to_es_logs
+            self.to_es_logs = []
+        self.output_to_es(to_es_logs)
+
+    def close(self):
+        self.flush()
+
+
+class AsyncESLogHandler(ESLogHandler):
+    def __init__(self, index_name, level=logging.NOTSET):
+        ESLogHandler.__init__(self, index_name, level=level)
+        self.pid = None
+        self.start()
+
+    # fork出的子进程没有后台线程，需要重新创建
+    def start(self):
+        self.pid = os.getpid()
+        self.records = queue.Queue(maxsize=ESLOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # 写入es时产生的日志不再写入es
+    # 在获取handler的锁之前返回，flush和close持有锁等待后台线程时不会死锁
+    def handle(self, record):
+        if threading.get_ident() == self.thread.ident:
+            return False
+        return ESLogHandler.handle(self, record)
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.records.put_nowait(self.get_source(record))
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped = self.dropped + 1
+
+    def run(self):
+        sources = []
+        deadline = time.time() + ESLOG_FLUSH_INTERVAL
+        while True:
+            try:
+                source = self.records.get(
+                    timeout=max(0, deadline - time.time()))
+                if source is ESLOG_STOP:
+                    break
+                if isinstance(source, threading.Event):
+                    self.output_sources(sources)
+                    sources = []
+                    source.set()
+                    continue
+                sources.append(source)
+            except queue.Empty:
+                pass
+            if (len(sources) >= ESLOG_FLUSH_SIZE or
+                    time.time() >= deadline):
+                self.output_sources(sources)
+                sources = []
+                deadline = time.time() + ESLOG_FLUSH_INTERVAL
+        self.output_sources(sources)
+
+    def output_sources(self, sources):
+        with self.dropped_lock:
+            dropped = self.dropped
+            self.dropped = 0
+        if dropped > 0:
+            sources.append(self.get_dropped_source(dropped))
+        if len(sources) == 0:
+            return
+        writer = es.BulkWriter()
+        try:
+            for source in sources:
+                writer.add(self.index_name, None, source)
+            writer.flush()
+        except Exception as e:
+            sys.stderr.write(
+                f"Output logs to es failed. size: {len(sources)} ."
+                f"error: {e}\n")
+
+    def get_dropped_source(self, dropped):
+        return {
+            "@timestamp": get_es_datetime_str(time.time()),
+            "level": logging.getLevelName(logging.WARNING),
+            "name": "eslog",
+            "message": f"Drop logs. queue is full. size: {dropped}",
+            "module": "eslog",
+            "batches": self.batches,
+            "funcName": "emit"
+        }
+
+    # 等待后台线程写完队列中已有的日志
+    def flush(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            done = threading.Event()
+            self.records.put(done)
+            done.wait()
 
     def close(self):
-        self.output_to_es()
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.records.put(ESLOG_STOP)
+            self.thread.join()
+        logging.Handler.close(self)
@@ -1 +1,5 @@
 from .model import PlayerIdMap
+from .compact import CompactPlayerIdMap, PlayerIdSet, is_same_interner
+from .bitmap import BitmapPlayerIdMap, PlayerIdBitmap
+from .dictionary import PlayerIdDictionary
+from .factory import new_player_id_map, get_interner
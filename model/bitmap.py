@@ -0,0 +1,186 @@
+import numpy as np
+
+from .compact import CompactPlayerIdMap, resolve_interner, ID_DTYPE
+
+# roaring bitmap: 高16位分桶，桶内元素少时用有序数组，多时用位图
+CONTAINER_SIZE = 1 << 16
+ARRAY_MAX_SIZE = 4096
+LOW_DTYPE = np.uint16
+BITSET_DTYPE = np.uint8
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint32)
+
+
+def is_bitset(container):
+    return container.dtype == BITSET_DTYPE
+
+
+def get_cardinality(container):
+    if is_bitset(container):
+        return int(POPCOUNT[container].sum())
+    return len(container)
+
+
+def to_bitset(container):
+    if is_bitset(container):
+        return container
+    bits = np.zeros(CONTAINER_SIZE, dtype=np.bool_)
+    bits[container] = True
+    return np.packbits(bits, bitorder="little")
+
+
+def to_lows(container):
+    if not is_bitset(container):
+        return container
+    bits = np.unpackbits(container, bitorder="little")
+    return np.flatnonzero(bits).astype(LOW_DTYPE)
+
+
+def bitset_contains(bits, lows):
+    return ((bits[lows >> 3] >> (lows & 7).astype(BITSET_DTYPE)) & 1) == 1
+
+
+# 元素个数决定容器类型，空容器返回None
+def normalize(container):
+    size = get_cardinality(container)
+    if size == 0:
+        return None
+    if is_bitset(container) and size <= ARRAY_MAX_SIZE:
+        return to_lows(container)
+    if not is_bitset(container) and size > ARRAY_MAX_SIZE:
+        return to_bitset(container)
+    return container
+
+
+def container_and(a, b):
+    if is_bitset(a) and is_bitset(b):
+        return normalize(np.bitwise_and(a, b))
+    if is_bitset(a):
+        return normalize(b[bitset_contains(a, b)])
+    if is_bitset(b):
+        return normalize(a[bitset_contains(b, a)])
+    return normalize(np.intersect1d(a, b, assume_unique=True))
+
+
+def container_or(a, b):
+    if is_bitset(a) or is_bitset(b):
+        return normalize(np.bitwise_or(to_bitset(a), to_bitset(b)))
+    return normalize(np.union1d(a, b).astype(LOW_DTYPE))
+
+
+def container_and_not(a, b):
+    if is_bitset(a):
+        return normalize(np.bitwise_and(a, np.invert(to_bitset(b))))
+    if is_bitset(b):
+        return normalize(a[~bitset_contains(b, a)])
+    return normalize(np.setdiff1d(a, b, assume_unique=True))
+
+
+class PlayerIdBitmap():
+    # 压缩位图，接口和set一致，迭代得到的是player_id
+    def __init__(self, containers=None, interner=None):
+        self.containers = containers or {}
+        self.interner = resolve_interner(interner)
+
+    # values 是有序去重的数组
+    @classmethod
+    def from_array(cls, values, interner=None):
+        containers = {}
+        values = np.asarray(values, dtype=ID_DTYPE)
+        if len(values) > 0:
+            highs = values >> 16
+            keys, starts = np.unique(highs, return_index=True)
+            ends = np.append(starts[1:], len(values))
+            for key, start, end in zip(
+                    keys.tolist(), starts.tolist(), ends.tolist()):
+                lows = (values[start:end] & 0xFFFF).astype(LOW_DTYPE)
+                containers[key] = normalize(lows)
+        return cls(containers, interner)
+
+    @classmethod
+    def union_all(cls, player_id_sets, interner=None):
+        ret = cls(interner=interner)
+        for ids in player_id_sets:
+            ret = ret.union(ids)
+        return ret
+
+    def to_array(self):
+        values = []
+        for key in sorted(self.containers):
+            lows = to_lows(self.containers[key]).astype(ID_DTYPE)
+            values.append((np.uint32(key) << np.uint32(16)) | lows)
+        if len(values) == 0:
+            return np.empty(0, dtype=ID_DTYPE)
+        return np.concatenate(values)
+
+    def __len__(self):
+        return sum(get_cardinality(c) for c in self.containers.values())
+
+    def __iter__(self):
+        player_ids = self.interner.player_ids
+        for index in self.to_array().tolist():
+            yield player_ids[index]
+
+    def __contains__(self, player_id):
+        index = self.interner.ids.get(player_id)
+        if index is None:
+            return False
+        container = self.containers.get(index >> 16)
+        if container is None:
+            return False
+        low = np.array([index & 0xFFFF], dtype=LOW_DTYPE)
+        if is_bitset(container):
+            return bool(bitset_contains(container, low)[0])
+        position = np.searchsorted(container, low[0])
+        return position < len(container) and container[position] == low[0]
+
+    def __eq__(self, other):
+        return set(self) == set(other)
+
+    def get_bitmap(self, other):
+        if isinstance(other, PlayerIdBitmap) and (
+                other.interner is self.interner):
+            return other
+        indexes = self.interner.lookup_all(other)
+        values = np.unique(np.asarray(indexes, dtype=ID_DTYPE))
+        return PlayerIdBitmap.from_array(values, self.interner)
+
+    def intersection(self, *others):
+        containers = self.containers
+        for other in others:
+            other_containers = self.get_bitmap(other).containers
+            ret = {}
+            for key, container in containers.items():
+                if key not in other_containers:
+                    continue
+                value = container_and(container, other_containers[key])
+                if value is not None:
+                    ret[key] = value
+            containers = ret
+        return PlayerIdBitmap(containers, self.interner)
+
+    def union(self, *others):
+        containers = dict(self.containers)
+        for other in others:
+            for key, container in self.get_bitmap(other).containers.items():
+                if key in containers:
+                    container = container_or(containers[key], container)
+                containers[key] = container
+        return PlayerIdBitmap(containers, self.interner)
+
+    def difference(self, *others):
+        containers = self.containers
+        for other in others:
+            other_containers = self.get_bitmap(other).containers
+            ret = {}
+            for key, container in containers.items():
+                if key in other_containers:
+                    container = container_and_not(
+                        container, other_containers[key])
+                if container is not None:
+                    ret[key] = container
+            containers = ret
+        return PlayerIdBitmap(containers, self.interner)
+
+
+class BitmapPlayerIdMap(CompactPlayerIdMap):
+    set_class = PlayerIdBitmap
@@ -0,0 +1,265 @@
+from array import array
+from collections import Counter
+from itertools import chain
+
+import numpy as np
+
+from .model import PlayerIdMap, memoize_view
+
+ID_DTYPE = np.uint32
+ID_TYPECODE = "I"
+
+
+class PlayerIdInterner():
+    # player_id 映射成从0开始的连续整数
+    def __init__(self):
+        self.ids = {}
+        self.player_ids = []
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def intern(self, player_id):
+        index = self.ids.get(player_id)
+        if index is None:
+            index = len(self.player_ids)
+            self.ids[player_id] = index
+            self.player_ids.append(player_id)
+        return index
+
+    def intern_all(self, player_ids):
+        return [self.intern(player_id) for player_id in player_ids]
+
+    # 没有映射过的player_id不会在任何集合中，直接忽略
+    def lookup_all(self, player_ids):
+        ret = []
+        for player_id in player_ids:
+            index = self.ids.get(player_id)
+            if index is not None:
+                ret.append(index)
+        return ret
+
+    def get_player_id(self, index):
+        return self.player_ids[index]
+
+
+# 不同的map使用同一个interner，集合之间才能直接运算
+default_interner = PlayerIdInterner()
+
+
+# interner 为空时也是有效的，不能用 or 判断
+def resolve_interner(interner):
+    if interner is None:
+        return default_interner
+    return interner
+
+
+# 两个集合都是整数数组并且使用同一个interner时，整数才能直接比较
+def is_same_interner(a, b):
+    interner = getattr(a, "interner", None)
+    return (interner is not None and hasattr(a, "to_array") and
+            hasattr(b, "to_array") and
+            getattr(b, "interner", None) is interner)
+
+
+class PlayerIdSet():
+    # 有序去重的整数数组，接口和set一致，迭代得到的是player_id
+    def __init__(self, values=None, interner=None):
+        if values is None:
+            values = np.empty(0, dtype=ID_DTYPE)
+        self.values = values
+        self.interner = resolve_interner(interner)
+
+    @classmethod
+    def from_indexes(cls, indexes, interner=None):
+        values = np.unique(np.asarray(indexes, dtype=ID_DTYPE))
+        return cls.from_array(values, interner)
+
+    # values 是有序去重的数组
+    @classmethod
+    def from_array(cls, values, interner=None):
+        return cls(values, interner)
+
+    @classmethod
+    def union_all(cls, player_id_sets, interner=None):
+        values = [ids.to_array() for ids in player_id_sets]
+        if len(values) == 0:
+            return cls(interner=interner)
+        return cls.from_array(
+            np.unique(np.concatenate(values)).astype(ID_DTYPE), interner)
+
+    def to_array(self):
+        return self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        player_ids = self.interner.player_ids
+        for index in self.values.tolist():
+            yield player_ids[index]
+
+    def __contains__(self, player_id):
+        index = self.interner.ids.get(player_id)
+        if index is None:
+            return False
+        position = np.searchsorted(self.values, index)
+        return (position < len(self.values) and
+                self.values[position] == index)
+
+    def __eq__(self, other):
+        return set(self) == set(other)
+
+    def get_values(self, other):
+        if isinstance(other, PlayerIdSet) and other.interner is self.interner:
+            return other.values
+        indexes = self.interner.lookup_all(other)
+        return np.unique(np.asarray(indexes, dtype=ID_DTYPE))
+
+    def intersection(self, *others):
+        values = self.values
+        for other in others:
+            values = np.intersect1d(
+                values, self.get_values(other), assume_unique=True)
+        return PlayerIdSet(values, self.interner)
+
+    def union(self, *others):
+        values = self.values
+        for other in others:
+            values = np.union1d(values, self.get_values(other))
+        return PlayerIdSet(values.astype(ID_DTYPE), self.interner)
+
+    def difference(self, *others):
+        values = self.values
+        for other in others:
+            values = np.setdiff1d(
+                values, self.get_values(other), assume_unique=True)
+        return PlayerIdSet(values, self.interner)
+
+
+class CompactPlayerIdMap(PlayerIdMap):
+    # 和PlayerIdMap接口一致，put先追加到缓冲区，读取时再排序去重
+    # 新的player_id在flush时一起映射，持久化的映射每次flush只写一次文件
+    set_class = PlayerIdSet
+
+    def __init__(self, interner=None):
+        self.interner = resolve_interner(interner)
+        self.compact_map = {}
+        self.pending = {}
+        self.pending_ids = {}
+        self.views = {}
+
+    @property
+    def player_id_map(self):
+        self.flush()
+        return self.compact_map
+
+    def put(self, time_str, platform, channel, player_id):
+        if self.views:
+            self.views = {}
+        self.get_pending_ids(time_str, platform, channel).append(player_id)
+
+    def put_ids(self, time_str, platform, channel, player_ids):
+        if self.views:
+            self.views = {}
+        if isinstance(player_ids, self.set_class) and (
+                player_ids.interner is self.interner):
+            self.get_pending(time_str, platform, channel).extend(
+                player_ids.to_array().tolist())
+        else:
+            self.get_pending_ids(time_str, platform, channel).extend(
+                player_ids)
+
+    def get_pending(self, time_str, platform, channel):
+        key = (platform, channel, time_str)
+        if key not in self.pending:
+            self.pending[key] = array(ID_TYPECODE)
+        return self.pending[key]
+
+    def get_pending_ids(self, time_str, platform, channel):
+        key = (platform, channel, time_str)
+        if key not in self.pending_ids:
+            self.pending_ids[key] = []
+        return self.pending_ids[key]
+
+    def intern_pending(self):
+        if len(self.pending_ids) == 0:
+            return
+        indexes = self.interner.intern_all(
+            list(chain.from_iterable(self.pending_ids.values())))
+        offset = 0
+        for (platform, channel, time_str), player_ids in (
+                self.pending_ids.items()):
+            self.get_pending(time_str, platform, channel).extend(
+                indexes[offset:offset + len(player_ids)])
+            offset = offset + len(player_ids)
+        self.pending_ids = {}
+
+    def flush(self):
+        self.intern_pending()
+        if len(self.pending) == 0:
+            return
+        for (platform, channel, time_str), pending in self.pending.items():
+            days = self.compact_map.setdefault(
+                platform, {}).setdefault(channel, {})
+            values = np.frombuffer(pending, dtype=ID_DTYPE)
+            if time_str in days:
+                values = np.concatenate([days[time_str].to_array(), values])
+            days[time_str] = self.set_class.from_array(
+                np.unique(values), self.interner)
+        self.pending = {}
+
+    def update(self, other):
+        for platform, channels in other.player_id_map.items():
+            for channel, days in channels.items():
+                for day, ids in days.items():
+                    self.put_ids(day, platform, channel, ids)
+
+    @memoize_view
+    def get_total_player_ids(self):
+        ret = {}
+        for platform, channels in self.player_id_map.items():
+            platform_map = ret.setdefault(platform, {})
+            for channel, days in channels.items():
+                platform_map[channel] = self.set_class.union_all(
+                    days.values(), self.interner)
+        return ret
+
+    def get_some_day_player_ids(self, platform, channel, time_str):
+        channels = self.player_id_map.get(platform, {}).get(channel, {})
+        ids = channels.get(time_str)
+        if ids is not None and len(ids) > 0:
+            return ids, True
+        return self.set_class(interner=self.interner), False
+
+    @memoize_view
+    def get_all_day_player_ids(self, platform, channel):
+        channels = self.player_id_map.get(platform, {}).get(channel, {})
+        ret = self.set_class.union_all(channels.values(), self.interner)
+        return ret, len(channels) > 0
+
+    @memoize_view
+    def get_total_player_ids_counter(self):
+        ret = {}
+        for platform, channels in self.player_id_map.items():
+            platform_map = ret.setdefault(platform, {})
+            for channel, days in channels.items():
+                platform_map[channel] = self.get_counter(days.values())
+        return ret
+
+    @memoize_view
+    def get_all_day_player_ids_counter(self, platform, channel):
+        channels = self.player_id_map.get(platform, {}).get(channel, {})
+        return self.get_counter(channels.values()), len(channels) > 0
+
+    def get_counter(self, player_id_sets):
+        ret = Counter()
+        values = [ids.to_array() for ids in player_id_sets]
+        if len(values) == 0:
+            return ret
+        indexes, counts = np.unique(
+            np.concatenate(values), return_counts=True)
+        player_ids = self.interner.player_ids
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            ret[player_ids[index]] = count
+        return ret
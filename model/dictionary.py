@@ -0,0 +1,119 @@
+import fcntl
+import logging
+import os
+import re
+import threading
+import uuid
+
+from .compact import PlayerIdInterner
+
+PLAYER_ID_SEPARATOR = b"\n"
+# player_id中的换行和反斜杠需要转义，否则一个player_id会读成两行
+ESCAPE_CHAR = "\\"
+ESCAPES = {"\\": "\\\\", "\n": "\\n"}
+UNESCAPES = {"n": "\n"}
+# 新建的文件第一行记录随机的名字，整数id只在同一个文件内有效
+# 没有这一行的旧文件可以使用，但是不能持久化整数id
+HEADER_PREFIX = b"#player-id-dictionary "
+ESCAPED_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+
+logger = logging.getLogger()
+
+
+class PlayerIdDictionary(PlayerIdInterner):
+    # 持久化的player_id映射，文件中第n个player_id对应整数n
+    # 只追加不修改，不同天，不同进程生成的位图可以直接运算
+    def __init__(self, path):
+        PlayerIdInterner.__init__(self)
+        self.path = path
+        self.offset = 0
+        self.name = None
+        self.lock = threading.Lock()
+        self.load()
+        logger.info(
+            f"Load player id dictionary. path: {path} ."
+            f"size: {len(self)}")
+
+    # 只读取完整的行，从上次读取的位置继续
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(PLAYER_ID_SEPARATOR) + 1
+        if end == 0:
+            return
+        start = 0
+        if self.offset == 0 and data.startswith(HEADER_PREFIX):
+            start = data.index(PLAYER_ID_SEPARATOR) + 1
+            self.name = data[len(HEADER_PREFIX):start - 1].decode("utf-8")
+        if start == end:
+            self.offset = end
+            return
+        for player_id in data[start:end - 1].split(PLAYER_ID_SEPARATOR):
+            PlayerIdInterner.intern(
+                self, decode_player_id(player_id))
+        self.offset = self.offset + end
+
+    # 读取其他进程追加的player_id
+    def refresh(self):
+        with self.lock:
+            self.load()
+
+    def intern(self, player_id):
+        index = self.ids.get(player_id)
+        if index is None:
+            index = self.intern_all([player_id])[0]
+        return index
+
+    def intern_all(self, player_ids):
+        missing = [p for p in player_ids if p not in self.ids]
+        if len(missing) > 0:
+            self.append(list(dict.fromkeys(missing)))
+        ids = self.ids
+        return [ids[player_id] for player_id in player_ids]
+
+    # 加文件锁后先读取其他进程追加的player_id，保证行号就是整数id
+    def append(self, player_ids):
+        with self.lock:
+            dir_name = os.path.dirname(self.path)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+            with open(self.path, "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self.load()
+                    # 进程异常退出时可能留下不完整的行
+                    f.truncate(self.offset)
+                    new_ids = [p for p in player_ids if p not in self.ids]
+                    header = b""
+                    if self.offset == 0:
+                        self.name = uuid.uuid4().hex
+                        header = (HEADER_PREFIX + self.name.encode("utf-8") +
+                                  PLAYER_ID_SEPARATOR)
+                    data = header + b"".join(
+                        encode_player_id(p) + PLAYER_ID_SEPARATOR
+                        for p in new_ids)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    for player_id in new_ids:
+                        PlayerIdInterner.intern(self, player_id)
+                    self.offset = self.offset + len(data)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def encode_player_id(player_id):
+    if ESCAPE_CHAR in player_id or "\n" in player_id:
+        player_id = "".join(ESCAPES.get(c, c) for c in player_id)
+    return player_id.encode("utf-8")
+
+
+def decode_player_id(data):
+    player_id = data.decode("utf-8")
+    if ESCAPE_CHAR not in player_id:
+        return player_id
+    return ESCAPED_PATTERN.sub(
+        lambda m: UNESCAPES.get(m.group(1), m.group(1)), player_id)
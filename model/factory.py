@@ -0,0 +1,33 @@
+import os
+
+from .model import PlayerIdMap
+from .compact import CompactPlayerIdMap, default_interner
+from .bitmap import BitmapPlayerIdMap
+from .dictionary import PlayerIdDictionary
+
+BACKEND_SET = "set"
+BACKEND_COMPACT = "compact"
+BACKEND_BITMAP = "bitmap"
+
+PLAYER_ID_MAP_BACKEND = os.getenv("PLAYER_ID_MAP_BACKEND", BACKEND_SET)
+PLAYER_ID_DICTIONARY = os.getenv("PLAYER_ID_DICTIONARY")
+
+dictionary = None
+
+
+def new_player_id_map():
+    if PLAYER_ID_MAP_BACKEND == BACKEND_COMPACT:
+        return CompactPlayerIdMap(get_interner())
+    if PLAYER_ID_MAP_BACKEND == BACKEND_BITMAP:
+        return BitmapPlayerIdMap(get_interner())
+    return PlayerIdMap()
+
+
+# 配置了PLAYER_ID_DICTIONARY时使用持久化的映射
+def get_interner():
+    global dictionary
+    if not PLAYER_ID_DICTIONARY or not PLAYER_ID_DICTIONARY.strip():
+        return default_interner
+    if dictionary is None:
+        dictionary = PlayerIdDictionary(PLAYER_ID_DICTIONARY)
+    return dictionary
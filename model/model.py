@@ -1,3 +1,4 @@
+import functools
 from collections import Counter
 
 
@@ -19,21 +20,51 @@ def set_default_counter_for_map(map, key):
     return map[key]
 
 
+# 聚合结果按方法名和参数缓存到views中，put时清空，调用方不能修改返回值
+def memoize_view(func):
+    @functools.wraps(func)
+    def wrapper(self, *args):
+        key = (func.__name__,) + args
+        if key not in self.views:
+            self.views[key] = func(self, *args)
+        return self.views[key]
+    return wrapper
+
+
 class PlayerIdMap():
     # 按平台，渠道,日期划分playerId的set
     def __init__(self):
         self.player_id_map = {}
+        self.views = {}
 
     def __len__(self):
         return len(self.player_id_map)
 
     def put(self, time_str, platform, channel, player_id):
+        if self.views:
+            self.views = {}
         channels = set_default_map_for_map(
             self.player_id_map, platform)
         days = set_default_map_for_map(channels, channel)
         player_ids = set_default_set_for_map(days, time_str)
         player_ids.add(player_id)
 
+    def put_ids(self, time_str, platform, channel, player_ids):
+        if self.views:
+            self.views = {}
+        channels = set_default_map_for_map(
+            self.player_id_map, platform)
+        days = set_default_map_for_map(channels, channel)
+        ids = set_default_set_for_map(days, time_str)
+        ids.update(player_ids)
+
+    def update(self, other):
+        for platform, channels in other.player_id_map.items():
+            for channel, days in channels.items():
+                for day, ids in days.items():
+                    self.put_ids(day, platform, channel, ids)
+
+    @memoize_view
     def get_total_player_ids(self):
         ret = {}
         for platform, channels in self.player_id_map.items():
@@ -44,6 +75,7 @@ class PlayerIdMap():
                     player_ids.update(ids)
         return ret
 
+    @memoize_view
     def get_days(self):
         ret = set()
         for platform, channels in self.player_id_map.items():
@@ -61,6 +93,7 @@ class PlayerIdMap():
                     return ids, True
         return set(), False
 
+    @memoize_view
     def get_all_day_player_ids(self, platform, channel):
         ret = set()
         channels = self.player_id_map.get(platform, {}).get(channel, {})
@@ -78,6 +111,7 @@ class PlayerIdMap():
                     ret = ret + len(ids)
         return ret
 
+    @memoize_view
     def get_total_player_ids_counter(self):
         ret = {}
         for platform, channels in self.player_id_map.items():
@@ -88,6 +122,7 @@ class PlayerIdMap():
                     player_ids.update(ids)
         return ret
 
+    @memoize_view
     def get_all_day_player_ids_counter(self, platform, channel):
         ret = Counter()
         channels = self.player_id_map.get(platform, {}).get(channel, {})
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import boto3
+from botocore.exceptions import ClientError
+
+# 本地目录或者s3://bucket/prefix，为空时不使用对象索引
+OBJECT_INDEX_DIR = os.getenv("OBJECT_INDEX_DIR")
+OBJECT_INDEX_SUFFIX = ".json.gz"
+S3_SCHEME = "s3://"
+S3_DELIMITER = "/"
+
+logger = logging.getLogger()
+
+s3_client = None
+# 同一个目录下的对象共用一个清单
+# (bucket_name, dir_name) -> {key: entry}
+manifests = {}
+# 解析后还没有写入清单的 (bucket_name, key, entry)
+pending = []
+index_lock = threading.Lock()
+
+
+def is_enabled():
+    return bool(OBJECT_INDEX_DIR and OBJECT_INDEX_DIR.strip())
+
+
+# 每个对象记录时间范围，每个事件的行数和时间范围，字节数和行数
+def new_entry(obj):
+    if not is_enabled():
+        return None
+    return {
+        "e_tag": obj.e_tag,
+        "bytes": obj.size,
+        "lines": 0,
+        "min_time": None,
+        "max_time": None,
+        "events": {}
+    }
+
+
+# sub_lines是split_line的结果，格式错误的行只计入行数
+def add_line(entry, sub_lines):
+    entry["lines"] = entry["lines"] + 1
+    if not sub_lines:
+        return
+    try:
+        log_time = int(sub_lines[0])
+    except ValueError:
+        log_time = None
+    event = entry["events"].get(sub_lines[1])
+    if event is None:
+        event = {"count": 0, "min_time": log_time, "max_time": log_time}
+        entry["events"][sub_lines[1]] = event
+    event["count"] = event["count"] + 1
+    if log_time is None:
+        return
+    update_time_range(event, log_time)
+    update_time_range(entry, log_time)
+
+
+def update_time_range(value, log_time):
+    if value["min_time"] is None or log_time < value["min_time"]:
+        value["min_time"] = log_time
+    if value["max_time"] is None or log_time > value["max_time"]:
+        value["max_time"] = log_time
+
+
+def record(obj, entry):
+    if entry is None:
+        return
+    with index_lock:
+        pending.append((obj.bucket_name, obj.key, entry))
+
+
+# 解析进程中记录的索引交给主进程写入
+def take_pending():
+    global pending
+    with index_lock:
+        ret = pending
+        pending = []
+    return ret
+
+
+def extend_pending(entries):
+    with index_lock:
+        pending.extend(entries)
+
+
+# ETag不一致说明对象已经改变，索引无效
+def get(obj):
+    if not is_enabled():
+        return None
+    manifest = get_manifest(obj.bucket_name, get_dir_name(obj.key))
+    entry = manifest.get(obj.key)
+    if entry is None or entry["e_tag"] != obj.e_tag:
+        return None
+    return entry
+
+
+# windows: [(start_time, end_time)]，都是闭区间
+# 没有索引的对象不能确定，当作可能包含
+def may_contain(obj, event, windows):
+    entry = get(obj)
+    if entry is None:
+        return True
+    event_entry = entry["events"].get(event)
+    if event_entry is None:
+        return False
+    if event_entry["min_time"] is None:
+        return True
+    for start_time, end_time in windows:
+        if (event_entry["max_time"] >= start_time and
+                event_entry["min_time"] <= end_time):
+            return True
+    return False
+
+
+def filter_objects(objs, event, start_time, end_time):
+    if not is_enabled():
+        return objs
+    ret = [obj for obj in objs
+           if may_contain(obj, event, [(start_time, end_time)])]
+    if len(ret) < len(objs):
+        logger.info(
+            f"Skip objects by index. event: {event} ."
+            f"object size: {len(objs)} ."
+            f"skip size: {len(objs) - len(ret)}")
+    return ret
+
+
+def save():
+    entries = take_pending()
+    if len(entries) == 0:
+        return
+    dirs = {}
+    for bucket_name, key, entry in entries:
+        dirs.setdefault(
+            (bucket_name, get_dir_name(key)), {})[key] = entry
+    for (bucket_name, dir_name), dir_entries in dirs.items():
+        manifest = get_manifest(bucket_name, dir_name)
+        with index_lock:
+            manifest.update(dir_entries)
+            data = gzip.compress(json.dumps(manifest).encode("utf-8"))
+        name = get_name(bucket_name, dir_name)
+        try:
+            write(name, data)
+        except (OSError, ClientError) as e:
+            logger.warn(
+                f"Write object index error. name: {name} . error: {e}")
+            continue
+        logger.info(
+            f"Save object index. dir: {dir_name} ."
+            f"object size: {len(dir_entries)}")
+
+
+def get_manifest(bucket_name, dir_name):
+    manifest = manifests.get((bucket_name, dir_name))
+    if manifest is not None:
+        return manifest
+    manifest = load_manifest(bucket_name, dir_name)
+    with index_lock:
+        return manifests.setdefault((bucket_name, dir_name), manifest)
+
+
+def load_manifest(bucket_name, dir_name):
+    name = get_name(bucket_name, dir_name)
+    try:
+        data = read(name)
+        if data is None:
+            return {}
+        return json.loads(gzip.decompress(data).decode("utf-8"))
+    except (OSError, ValueError, ClientError) as e:
+        logger.warn(f"Read object index error. name: {name} . error: {e}")
+        return {}
+
+
+def get_dir_name(key):
+    return key.rpartition(S3_DELIMITER)[0]
+
+
+def get_name(bucket_name, dir_name):
+    digest = hashlib.sha1(
+        (bucket_name + S3_DELIMITER + dir_name).encode("utf-8")).hexdigest()
+    return S3_DELIMITER.join([bucket_name, digest + OBJECT_INDEX_SUFFIX])
+
+
+def read(name):
+    if is_s3():
+        bucket_name, key = get_s3_location(name)
+        try:
+            response = get_s3_client().get_object(
+                Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in (
+                    "NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read()
+    path = os.path.join(OBJECT_INDEX_DIR, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write(name, data):
+    if is_s3():
+        bucket_name, key = get_s3_location(name)
+        get_s3_client().put_object(Bucket=bucket_name, Key=key, Body=data)
+        return
+    path = os.path.join(OBJECT_INDEX_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + "." + str(os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def is_s3():
+    return OBJECT_INDEX_DIR.startswith(S3_SCHEME)
+
+
+def get_s3_location(name):
+    location = OBJECT_INDEX_DIR[len(S3_SCHEME):]
+    bucket_name, _, prefix = location.partition("/")
+    prefix = prefix.strip("/")
+    if prefix:
+        name = prefix + "/" + name
+    return bucket_name, name
+
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        s3_client = boto3.client("s3", os.getenv("AWS_REGION"))
+    return s3_client
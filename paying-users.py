@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import os
-import json
 import argparse
 import sys
 import array
@@ -77,36 +76,21 @@ def get_paying_users(time_str):
 def output_to_es(time_str, players):
     if len(players) == 0:
         return
-    data = []
-
+    writer = es.BulkWriter()
     for key, value in players.items():
-        data.append(es_get_doc(time_str, key, value))
-    size = len(data)
-    start = 0
-    end = 0
-    while (end < size):
-
-        start = end
-        end = end + es.ES_BULK_SIZE
-        if end >= size:
-            end = size
-        es.batch_add_doc(ES_PAYING_USERS_INDEX, "".join(data[start: end]))
-        logger.info(f"Add docs success. between {start} and {end}")
+        writer.add(ES_PAYING_USERS_INDEX, key, es_get_doc(time_str, value))
+    writer.close()
 
 
-def es_get_doc(time_str, id, log):
+def es_get_doc(time_str, log):
     timestamp = util.get_timestamp(time_str)
-    action = {
-        "index": {"_id": id}
-    }
-    ret = json.dumps(action) + es.ES_NEWLINE
     source = {
         "player_id": log["player_id"],
         "platform": log["platform"],
         "channel":  log["channel"],
         "@timestamp": timestamp
     }
-    return ret + json.dumps(source) + es.ES_NEWLINE
+    return source
 
 
 def test_output_to_es():
@@ -7,13 +7,13 @@ import os
 import re
 import sys
 import time
-from datetime import date, datetime, timedelta
+from datetime import datetime, timedelta
 
 from eslog import eslog
 from util import util
 from s3 import s3
 from es import es
-from model import PlayerIdMap
+from model import new_player_id_map
 
 AWS_REGION = os.getenv("AWS_REGION")
 S3_BUCKET = os.getenv("S3_BUCKET")
@@ -74,6 +74,36 @@ def process(time_str):
 
 
 # ==========================for compute retention count========================
+def get_inputs(time_str):
+    inputs = util.get_player_inputs(
+        CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
+        [util.get_some_day_of_one_day(time_str, -1)])
+    inputs.extend(util.get_player_inputs(
+        PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN, [time_str]))
+    if util.is_first_day_of_week(time_str):
+        inputs.extend(get_period_inputs(
+            util.get_previous_one_week_days(time_str),
+            util.get_previous_one_week_days))
+    if util.is_first_day_of_month(time_str):
+        inputs.extend(get_period_inputs(
+            util.get_previous_one_month_days(time_str),
+            util.get_previous_one_month_days))
+    return inputs
+
+
+# 和compute_week_count, compute_month_count读取的天一致
+def get_period_inputs(last_days, get_previous_days):
+    one_ago_days = get_previous_days(last_days[0])
+    two_ago_days = get_previous_days(one_ago_days[0])
+    inputs = util.get_player_inputs(
+        CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
+        one_ago_days + two_ago_days)
+    inputs.extend(util.get_player_inputs(
+        PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN,
+        last_days + one_ago_days))
+    return inputs
+
+
 def compute(time_str):
     ret = {}
     ret.update(compute_retention_day_count(time_str))
@@ -88,7 +118,7 @@ def compute(time_str):
 def compute_retention_day_count(time_str):
     logger.info(
         f"Compute retention_day_count. date:{time_str}. ")
-    today = date.today().strftime(util.ARG_DATE_FORMAT)
+    today = util.get_today().strftime(util.ARG_DATE_FORMAT)
     days = util.days_compute(today, time_str)
     create_days = days - 1
     create_map, file_exist = util.get_players(
@@ -140,7 +170,7 @@ def compute_month_count(time_str):
 
 
 def get_returning_count(create_days, first_login_days, second_login_map):
-    create_map = PlayerIdMap()
+    create_map = new_player_id_map()
     ret = {}
     file_exist = util.get_players_multiple_days(
         bucket, CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
@@ -150,7 +180,7 @@ def get_returning_count(create_days, first_login_days, second_login_map):
                     f" date start:{create_days[0]}. "
                     f" date end:{create_days[-1]}. ")
         return ret
-    first_login_map = PlayerIdMap()
+    first_login_map = new_player_id_map()
     util.get_players_multiple_days(
         bucket, PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN,
         first_login_days, first_login_map)
@@ -181,8 +211,8 @@ def compute_returning_count(create_map, first_login_map, second_login_map):
 
 def get_retention_and_churn_counts(create_days, login_days):
     ret_date = create_days[0]
-    create_map = PlayerIdMap()
-    login_map = PlayerIdMap()
+    create_map = new_player_id_map()
+    login_map = new_player_id_map()
     ret = {
         "retention_count": {},
         "churn_count": {}}
@@ -234,17 +264,19 @@ def compute_churn_count(retention_count):
 def output_to_es(retentions):
     if len(retentions) == 0:
         return
+    writer = es.BulkWriter()
     for key, values in retentions.items():
         for time_str, ret in values.items():
             for ret_key, ret_value in ret.items():
-                es_add_doc(time_str, key + "_count", ret_key, ret_value)
+                es_add_doc(
+                    writer, time_str, key + "_count", ret_key, ret_value)
+    writer.close()
 
 
-def es_add_doc(time_str, compute_type, ret_key, ret_value):
-    path = ES_INDEX + \
-        "/_doc/" + es_get_doc_id(time_str, compute_type, ret_key)
+def es_add_doc(writer, time_str, compute_type, ret_key, ret_value):
+    doc_id = es_get_doc_id(time_str, compute_type, ret_key)
     data = es_get_doc(time_str, compute_type, ret_key, ret_value)
-    es.add_doc(path, data)
+    writer.add(ES_INDEX, doc_id, data)
 
 
 def es_get_doc(time_str, compute_type, ret_key, ret_value):
@@ -279,7 +311,7 @@ def test_compute_retention():
 
 def get_start_timestamp(day):
 
-    d = (date.today() + timedelta(days=day))
+    d = (util.get_today() + timedelta(days=day))
     return int(time.mktime())
 
 
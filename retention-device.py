@@ -7,7 +7,7 @@ import time
 import argparse
 import sys
 import re
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 import requests
 from requests.auth import HTTPBasicAuth
 import encodings
@@ -27,6 +27,12 @@ RETENTION_DAYS = os.getenv("RETENTION_DAYS")
 ES_INDEX = os.getenv("ES_INDEX", "retention")
 RETENTION_TRACK_DAYS = os.getenv("RETENTION_TRACK_DAYS", 30)
 GPERF_INDEX_PREFIX = os.getenv("GPERF_INDEX_PREFIX", "gperf-index-")
+GPERF_PLAYER_ID_FIELD = "tags.player_id"
+# terms查询需要keyword类型的字段
+GPERF_PLAYER_ID_TERMS_FIELD = os.getenv(
+    "GPERF_PLAYER_ID_TERMS_FIELD", GPERF_PLAYER_ID_FIELD + ".keyword")
+GPERF_SOURCE_FIELDS = [
+    GPERF_PLAYER_ID_FIELD, "device.vendor", "device.model"]
 
 RETENTION_DAY_PREFIX = "day"
 COMMA = ","
@@ -84,8 +90,20 @@ def process(time_str):
 
 # ==========================for compute retention=============================
 
+def get_inputs(time_str):
+    create_days = set()
+    for _, value in get_retention_days().items():
+        create_days.add(util.get_some_day_of_one_day(time_str, value))
+    inputs = util.get_player_inputs(
+        PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN, [time_str])
+    inputs.extend(util.get_player_inputs(
+        CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
+        sorted(create_days)))
+    return inputs
+
+
 def compute(time_str):
-    today = date.today().strftime(util.ARG_DATE_FORMAT)
+    today = util.get_today().strftime(util.ARG_DATE_FORMAT)
     days = util.days_compute(today, time_str)
     login_map, _ = util.get_players(
         bucket, PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN, days)
@@ -131,7 +149,7 @@ def get_retention(time_str, login_map, days):
     event_time = util.get_some_day(days)
     if ceates_size == 0:
         return ret, False
-    devices = get_devices(event_time)
+    devices = get_devices(event_time, get_player_ids(create_player_ids))
     unknown = {("UNKNOWN", "UNKNOWN")}
     for platform, channels in create_player_ids.items():
         for channel, create_set in channels.items():
@@ -156,18 +174,28 @@ def get_retention(time_str, login_map, days):
     return ret, True
 
 
-def get_devices(time_str):
+def get_player_ids(player_ids):
+    ret = set()
+    for channels in player_ids.values():
+        for ids in channels.values():
+            ret.update(ids)
+    return ret
+
+
+# 留存的玩家一定是新增的玩家，只查询新增玩家的设备
+def get_devices(time_str, player_ids):
     str_time = time.strftime(
         "%Y.%m.%d", time.strptime(time_str, util.ARG_DATE_FORMAT))
     index = GPERF_INDEX_PREFIX + str_time
     ret = {}
     logger.info("Get devices from es")
-    logs = es.query_match_all(index, es.get_match_all_dsl())
-    logger.info(f"Devices size is {len(logs)}")
-    for log in logs:
-        ret[log["_source"]["tags"]["player_id"]] = (
-            log["_source"]["device"]["vendor"],
-            log["_source"]["device"]["model"])
+    sources = es.get_sources_by_terms(
+        index, GPERF_PLAYER_ID_FIELD, player_ids, GPERF_SOURCE_FIELDS,
+        GPERF_PLAYER_ID_TERMS_FIELD)
+    for player_id, source in sources.items():
+        ret[player_id] = (
+            source["device"]["vendor"], source["device"]["model"])
+    logger.info(f"Devices size is {len(ret)}")
     return ret
 
 
@@ -175,6 +203,7 @@ def get_devices(time_str):
 def output_to_es(time_str, retention_devices):
     if len(retention_devices) == 0:
         return
+    writer = es.BulkWriter()
     for day, values in retention_devices.items():
         for ret_key, counters in values.items():
             retention_type = "retention_device" + "_" + day
@@ -183,19 +212,20 @@ def output_to_es(time_str, retention_devices):
             create_type = "create_device" + "_" + day
             for device, count in retention_counter.items():
                 es_add_doc(
-                            ret_key[0], retention_type, ret_key, device, count)
+                    writer, ret_key[0], retention_type, ret_key, device,
+                    count)
             for device1, count1 in create_counter.items():
                 es_add_doc(
-                            ret_key[0], create_type, ret_key, device1, count1)
+                    writer, ret_key[0], create_type, ret_key, device1,
+                    count1)
+    writer.close()
 
 
-def es_add_doc(time_str, compute_type, ret_key, device, count):
-    path = ES_INDEX + \
-        "/_doc/" + es_get_doc_id(
-            time_str, ret_key[1], ret_key[2],
-            compute_type, device[0], device[1])
+def es_add_doc(writer, time_str, compute_type, ret_key, device, count):
+    doc_id = es_get_doc_id(
+        time_str, ret_key[1], ret_key[2], compute_type, device[0], device[1])
     data = es_get_doc(time_str, compute_type, ret_key, device, count)
-    es.add_doc(path, data)
+    writer.add(ES_INDEX, doc_id, data)
 
 
 def es_get_doc(time_str, compute_type, ret_key,  device, count):
@@ -7,14 +7,15 @@ import os
 import re
 import sys
 import time
-from datetime import date, datetime, timedelta
+from datetime import datetime, timedelta
 from collections import Counter
+import numpy as np
 
 from eslog import eslog
 from util import util
 from s3 import s3
 from es import es
-from model import PlayerIdMap
+from model import new_player_id_map, is_same_interner
 
 AWS_REGION = os.getenv("AWS_REGION")
 S3_BUCKET = os.getenv("S3_BUCKET")
@@ -24,9 +25,12 @@ CREATE_PLAYER_EVENT = os.getenv("CREATE_PLAYER_EVENT")
 PLAYER_LOGIN_EVENT = os.getenv("PLAYER_LOGIN_EVENT")
 ES_INDEX = os.getenv("ES_INDEX", "retention")
 
-EFFECTIVE_INTERVAL = os.getenv("EFFECTIVE_INTERVAL", 7)
-CREATE_PLAYER_EFFECTIVE_DAYS = os.getenv("CREATE_PLAYER_EFFECTIVE_DAYS", 2)
-PLAYER_LOGIN_EFFECTIVE_DAYS = os.getenv("PLAYER_LOGIN_EFFECTIVE_DAYS", 3)
+EFFECTIVE_INTERVAL = int(os.getenv("EFFECTIVE_INTERVAL", 7))
+CREATE_PLAYER_EFFECTIVE_DAYS = int(
+    os.getenv("CREATE_PLAYER_EFFECTIVE_DAYS", 2))
+PLAYER_LOGIN_EFFECTIVE_DAYS = int(os.getenv("PLAYER_LOGIN_EFFECTIVE_DAYS", 3))
+# 额外的有效天数，逗号分隔，结果类型为effective_count_<n>_day
+EFFECTIVE_EXTRA_DAYS = os.getenv("EFFECTIVE_EXTRA_DAYS", "")
 
 CHURN_DAYS = os.getenv("CHURN_DAYS", "1,3")
 
@@ -81,6 +85,18 @@ def process(time_str):
 
 
 # ==========================for compute retention count========================
+def get_inputs(time_str):
+    start_date = util.get_some_day_of_one_day(
+        time_str, (-EFFECTIVE_INTERVAL) + 1)
+    login_start_date = util.get_some_day_of_one_day(start_date, 1)
+    inputs = util.get_player_inputs(
+        CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER, [start_date])
+    inputs.extend(util.get_player_inputs(
+        PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN,
+        util.get_date_list(login_start_date, time_str)))
+    return inputs
+
+
 def compute(time_str):
     start_date = util.get_some_day_of_one_day(
         time_str, (-EFFECTIVE_INTERVAL) + 1)
@@ -107,39 +123,35 @@ def compute_churn_rate(creates_without_day, login_map, login_days):
     days = CHURN_DAYS.split(",")
     keys = sorted(login_days)
     ret = {}
-    for day in days:
-        surplus_day = int(day) - 1
-        compute_days = keys[surplus_day:]
-        for platform, channels in creates_without_day.items():
-            for channel, create_set in channels.items():
-                if len(create_set) == 0:
-                    continue
-                compute_ret = set()
-                for compute_day in compute_days:
-                    ids, _ = login_map.get_some_day_player_ids(
-                            platform, channel, compute_day)
-                    compute_ret.update(ids)
-                compute_ret = create_set.difference(compute_ret)
+    for platform, channels in creates_without_day.items():
+        for channel, create_set in channels.items():
+            if len(create_set) == 0:
+                continue
+            channel_days = login_map.player_id_map.get(
+                platform, {}).get(channel, {})
+            last_days = get_last_login_days(create_set, channel_days, keys)
+            for day in days:
+                # 从第day天开始没有登录过就是流失，也就是最后登录在这之前
+                surplus_day = int(day) - 1
+                churn_count = int(np.count_nonzero(last_days < surplus_day))
                 key = "churn_rate_" + day + "_day"
-                ret[(key, platform, channel)] = (
-                    len(compute_ret), len(create_set))
+                ret[(key, platform, channel)] = (churn_count, len(create_set))
     return ret
 
 
-def get_churn_rate_ret(creates, login_map, ret):
-    compute_ret = set()
-    for compute_day in compute_days:
-        compute_ret.update(
-            login_map.get_some_day_player_ids(
-                platform, channel, compute_day))
-    compute_ret = create_set.difference(compute_ret)
-    key = "churn_rate_" + day + "_day"
-    ret[(key, platform, channel)] = (
-        len(compute_ret), len(create_set))
+# 新增玩家最后一次登录的日期在keys中的下标，没有登录过的是-1
+def get_last_login_days(create_set, login_days, keys):
+    ret = np.full(len(create_set), -1, dtype=np.int64)
+    indexes = {}
+    for index, day in enumerate(keys):
+        if day in login_days:
+            ret[get_cohort_positions(
+                create_set, login_days[day], indexes)] = index
+    return ret
 
 
 def get_create_players(time_str):
-    today = date.today().strftime(util.ARG_DATE_FORMAT)
+    today = util.get_today().strftime(util.ARG_DATE_FORMAT)
     create_day = util.days_compute(today, time_str)
     create_map, file_exist = util.get_players(
         bucket, CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER, create_day)
@@ -151,7 +163,7 @@ def get_create_players(time_str):
 
 def get_login_players(start_date, end_date):
     login_days = util.get_date_list(start_date, end_date)
-    login_map = PlayerIdMap()
+    login_map = new_player_id_map()
     file_exist = util.get_players_multiple_days(
         bucket, PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN,
         login_days, login_map)
@@ -164,44 +176,81 @@ def get_login_players(start_date, end_date):
 
 def compute_effective_count(creates_without_day, login_map):
     ret = {}
+    thresholds = get_effective_thresholds()
     for platform, channels in creates_without_day.items():
         for channel, create_set in channels.items():
-            create_effective = 0
-            login_effective = 0
             if len(create_set) == 0:
                 continue
-            counter, has_id = login_map.get_all_day_player_ids_counter(
-                platform, channel)
-            if has_id:
-                for create in create_set:
-                    # +1 是加上创建的那天
-                    login_days = counter[create] + 1
-                    if login_days >= CREATE_PLAYER_EFFECTIVE_DAYS:
-                        create_effective = create_effective + 1
-                    if login_days >= PLAYER_LOGIN_EFFECTIVE_DAYS:
-                        login_effective = login_effective + 1
-            create_key = ("effective_create_count", platform, channel)
-            login_key = ("effective_login_count", platform, channel)
-            ret[create_key] = create_effective
-            ret[login_key] = login_effective
+            login_days = login_map.player_id_map.get(
+                platform, {}).get(channel, {})
+            # +1 是加上创建的那天
+            counts = get_login_day_counts(create_set, login_days) + 1
+            for key, days in thresholds:
+                effective = 0
+                if len(login_days) > 0:
+                    effective = int(np.count_nonzero(counts >= days))
+                ret[(key, platform, channel)] = effective
     return ret
 
 
+def get_effective_thresholds():
+    ret = [
+        ("effective_create_count", CREATE_PLAYER_EFFECTIVE_DAYS),
+        ("effective_login_count", PLAYER_LOGIN_EFFECTIVE_DAYS)]
+    for day in EFFECTIVE_EXTRA_DAYS.split(","):
+        if day.strip():
+            ret.append(
+                ("effective_count_" + day.strip() + "_day", int(day)))
+    return ret
+
+
+# 新增玩家在登录日期中登录的天数，新增玩家按下标对应数组中的位置
+def get_login_day_counts(create_set, login_days):
+    counts = np.zeros(len(create_set), dtype=np.int64)
+    indexes = {}
+    for login_set in login_days.values():
+        counts += np.bincount(
+            get_cohort_positions(create_set, login_set, indexes),
+            minlength=len(counts))
+    return counts
+
+
+# 同时在login_set中的新增玩家在create_set迭代顺序中的下标
+# interner不同时整数没有可比性，按player_id查找
+# indexes是调用方对同一个create_set共用的下标，第一次需要时建立
+def get_cohort_positions(create_set, login_set, indexes):
+    if is_same_interner(create_set, login_set):
+        cohort = create_set.to_array()
+        values = login_set.to_array()
+        if len(cohort) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.searchsorted(cohort, values)
+        positions[positions == len(cohort)] = 0
+        return positions[cohort[positions] == values]
+    if len(indexes) == 0:
+        indexes.update(
+            (player_id, index) for index, player_id in enumerate(create_set))
+    ids = login_set.intersection(create_set)
+    return np.fromiter(
+        (indexes[p] for p in ids), dtype=np.int64, count=len(ids))
+
+
 # ==========================for output to es=============================
 def output_to_es(time_str, effective_counts, churn_rates):
+    writer = es.BulkWriter()
     if len(effective_counts) > 0:
         for key, value in effective_counts.items():
-            es_add_doc(time_str, key, value)
+            es_add_doc(writer, time_str, key, value)
     if len(churn_rates) > 0:
         for key, value in churn_rates.items():
-            es_add_doc(time_str, key, value)
+            es_add_doc(writer, time_str, key, value)
+    writer.close()
 
 
-def es_add_doc(time_str, ret_key, ret_value):
-    path = ES_INDEX + \
-        "/_doc/" + es_get_doc_id(time_str, ret_key)
+def es_add_doc(writer, time_str, ret_key, ret_value):
+    doc_id = es_get_doc_id(time_str, ret_key)
     data = es_get_doc(time_str, ret_key, ret_value)
-    es.add_doc(path, data)
+    writer.add(ES_INDEX, doc_id, data)
 
 
 def es_get_doc(time_str, ret_key, ret_value):
@@ -240,7 +289,7 @@ def test_compute_retention():
 
 def get_start_timestamp(day):
 
-    d = (date.today() + timedelta(days=day))
+    d = (util.get_today() + timedelta(days=day))
     return int(time.mktime())
 
 
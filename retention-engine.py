@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import argparse
+import importlib
+import os
+import sys
+
+from eslog import eslog
+from util import util
+from s3 import s3
+from engine import engine
+
+ES_INDEX = os.getenv("ES_INDEX", "retention")
+ENGINE_JOBS = os.getenv(
+    "ENGINE_JOBS",
+    "retention,retention-count,retention-effective-count,"
+    "retention-device,active-paying-users")
+
+# 补数据时每次加载的天数，相邻批次共用的s3对象会重复读取
+BACKFILL_CHUNK_DAYS = int(os.getenv("BACKFILL_CHUNK_DAYS", 7))
+
+COMMA = ","
+
+logger = eslog.get_logger(ES_INDEX)
+
+
+def arg_parse(*args, **kwargs):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d", "--day",
+        nargs="?",
+        const=util.get_yesterday(),
+        type=util.valid_date,
+        default=util.get_yesterday(),
+        help="Date. The default date is yesterday. The format is YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        default=ENGINE_JOBS,
+        help="Jobs to run, separated by comma. The default is ENGINE_JOBS"
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=util.valid_date,
+        help="Backfill start date. The format is YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        type=util.valid_date,
+        default=util.get_yesterday(),
+        help="Backfill end date. The default date is yesterday. "
+        "The format is YYYY-MM-DD"
+    )
+    args = parser.parse_args()
+    if args.start is not None:
+        backfill(args.start, args.end, args.jobs.split(COMMA))
+    else:
+        process(args.day, args.jobs.split(COMMA))
+
+
+# 多个计算脚本在一个进程中执行，s3日志只下载解析一次
+def process(time_str, jobs):
+    modules = get_modules(jobs)
+    for module in modules:
+        module.valid_params()
+    inputs = get_inputs(modules, time_str)
+    bucket = s3.init_bucket_from_env()
+    engine.load(bucket, inputs)
+    process_modules(modules, time_str)
+    logger.info("Process end.")
+
+
+# 按批次加载多天的输入，某一天的数据在之后的日期都不再需要时才释放
+def backfill(start, end, jobs):
+    time_strs = util.get_date_list(start, end)
+    if len(time_strs) == 0:
+        logger.error(f"Params error. from: {start} is after to: {end}")
+        raise RuntimeError()
+    modules = get_modules(jobs)
+    for module in modules:
+        module.valid_params()
+    inputs = {}
+    last_uses = {}
+    for index, time_str in enumerate(time_strs):
+        inputs[time_str] = get_inputs(modules, time_str)
+        for value in inputs[time_str]:
+            last_uses[value] = index
+    bucket = s3.init_bucket_from_env()
+    for start_index in range(0, len(time_strs), BACKFILL_CHUNK_DAYS):
+        chunk = time_strs[start_index:start_index + BACKFILL_CHUNK_DAYS]
+        chunk_inputs = []
+        for time_str in chunk:
+            chunk_inputs.extend(inputs[time_str])
+        engine.load(bucket, chunk_inputs)
+        for time_str in chunk:
+            process_modules(modules, time_str)
+        end_index = start_index + len(chunk)
+        expired = [k for k, v in last_uses.items() if v < end_index]
+        engine.evict(expired)
+        for value in expired:
+            del last_uses[value]
+        logger.info(
+            f"Backfill chunk end. from: {chunk[0]} . to: {chunk[-1]} ."
+            f"evict size: {len(expired)}")
+    logger.info("Backfill end.")
+
+
+def get_inputs(modules, time_str):
+    ret = []
+    for module in modules:
+        ret.extend(module.get_inputs(time_str))
+    return ret
+
+
+def process_modules(modules, time_str):
+    for module in modules:
+        logger.info(
+            f"Process job start. job: {module.__name__} . date: {time_str}")
+        module.process(time_str)
+
+
+def get_modules(jobs):
+    ret = []
+    for job in jobs:
+        job = job.strip()
+        if util.is_empty(job):
+            continue
+        ret.append(importlib.import_module(job))
+    return ret
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(arg_parse(*sys.argv))
+    except KeyboardInterrupt:
+        logger.exception("CTL-C Pressed.")
+        exit("CTL-C Pressed.")
+    except Exception as e:
+        logger.exception(e)
+        exit("Exception")
@@ -7,15 +7,16 @@ import time
 import argparse
 import sys
 import re
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 import requests
 from requests.auth import HTTPBasicAuth
 import encodings
+import numpy as np
 from eslog import eslog
 from util import util
 from s3 import s3
 from es import es
-from model import PlayerIdMap
+from model import new_player_id_map, is_same_interner
 
 S3_KEY_PREFIX_CREATE_PLAYER = os.getenv("S3_KEY_PREFIX_CREATE_PLAYER")
 S3_KEY_PREFIX_PLAYER_LOGIN = os.getenv("S3_KEY_PREFIX_PLAYER_LOGIN")
@@ -24,6 +25,9 @@ PLAYER_LOGIN_EVENT = os.getenv("PLAYER_LOGIN_EVENT")
 RETENTION_DAYS = os.getenv("RETENTION_DAYS")
 ES_INDEX = os.getenv("ES_INDEX", "retention")
 RETENTION_TRACK_DAYS = os.getenv("RETENTION_TRACK_DAYS", 30)
+# 大于0时计算最近N天新增玩家每一天的留存(留存矩阵)
+RETENTION_MATRIX_DAYS = int(os.getenv("RETENTION_MATRIX_DAYS", 0))
+RETENTION_MATRIX_KEY = "retention_matrix"
 
 RETENTION_DAY_PREFIX = "day"
 COMMA = ","
@@ -82,14 +86,132 @@ def process(time_str):
 
 # ==========================for compute retention=============================
 
+def get_inputs(time_str):
+    create_days = set()
+    for _, value in get_retention_days().items():
+        create_days.add(util.get_some_day_of_one_day(time_str, value))
+    track_days = int(RETENTION_TRACK_DAYS)
+    start_date = util.get_some_day_of_one_day(time_str, -(track_days+1))
+    end_date = util.get_some_day_of_one_day(time_str, -1)
+    create_days.update(util.get_date_list(start_date, end_date))
+    login_days = {time_str}
+    if RETENTION_MATRIX_DAYS > 0:
+        matrix_days = get_matrix_days(time_str)
+        create_days.update(matrix_days)
+        login_days.update(matrix_days)
+    inputs = util.get_player_inputs(
+        PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN, sorted(login_days))
+    inputs.extend(util.get_player_inputs(
+        CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
+        sorted(create_days)))
+    return inputs
+
+
 def compute(time_str):
-    today = date.today().strftime(util.ARG_DATE_FORMAT)
+    today = util.get_today().strftime(util.ARG_DATE_FORMAT)
     days = util.days_compute(today, time_str)
     login_map, _ = util.get_players(
         bucket, PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN, days)
     retention = compute_retention(time_str, login_map, days)
     retention_track = compute_retention_track(time_str, login_map)
-    return {"retention": retention, "retention_track": retention_track}
+    ret = {"retention": retention, "retention_track": retention_track}
+    if RETENTION_MATRIX_DAYS > 0:
+        ret[RETENTION_MATRIX_KEY] = compute_retention_matrix(time_str)
+    return ret
+
+
+def get_matrix_days(time_str):
+    start_date = util.get_some_day_of_one_day(
+        time_str, -(RETENTION_MATRIX_DAYS - 1))
+    return util.get_date_list(start_date, time_str)
+
+
+# 结果的值是(新增当天及之后每一天的登录人数, 新增人数)
+def compute_retention_matrix(time_str):
+    logger.info(
+        f"Compute retention matrix date:{time_str}. "
+        f"retention matrix days: {RETENTION_MATRIX_DAYS}")
+    days = get_matrix_days(time_str)
+    create_map = new_player_id_map()
+    login_map = new_player_id_map()
+    ret = {}
+    file_exist = util.get_players_multiple_days(
+        bucket, CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
+        days, create_map)
+    if not file_exist:
+        logger.info(f"Create player file not exist."
+                    f" date start:{days[0]}. "
+                    f" date end:{days[-1]}. ")
+        return ret
+    util.get_players_multiple_days(
+        bucket, PLAYER_LOGIN_EVENT, S3_KEY_PREFIX_PLAYER_LOGIN,
+        days, login_map)
+    day_indexes = {day: index for index, day in enumerate(days)}
+    for platform, channels in create_map.player_id_map.items():
+        for channel, create_days in channels.items():
+            login_days = login_map.player_id_map.get(
+                platform, {}).get(channel, {})
+            matrix = get_retention_matrix(
+                day_indexes, create_days, login_days)
+            for index, value in matrix.items():
+                ret[(days[index], platform, channel)] = value
+    logger.info(f"Compute retention matrix size:{len(ret)}. ")
+    return ret
+
+
+# 一次遍历所有登录日，算出每个新增日期在之后每一天的留存人数
+def get_retention_matrix(day_indexes, create_days, login_days):
+    size = len(day_indexes)
+    cohorts = []
+    for day, create_set in create_days.items():
+        if day in day_indexes and len(create_set) > 0:
+            cohorts.append((day_indexes[day], create_set))
+    logins = []
+    for day, login_set in login_days.items():
+        if day in day_indexes:
+            logins.append((day_indexes[day], login_set))
+    counts = np.zeros((size, size), dtype=np.int64)
+    if is_same_interner_all([ids for _, ids in cohorts + logins]):
+        add_matrix_counts_by_array(counts, cohorts, logins)
+    else:
+        add_matrix_counts_by_player(counts, cohorts, logins)
+    ret = {}
+    for index, create_set in cohorts:
+        ret[index] = (counts[index, index:].tolist(), len(create_set))
+    return ret
+
+
+# 所有集合的interner相同时，整数id才能放在一起比较
+def is_same_interner_all(player_id_sets):
+    return all(is_same_interner(player_id_sets[0], ids)
+               for ids in player_id_sets)
+
+
+# 整数id的集合: 所有新增玩家拼成一个数组，每个登录日一次isin和bincount
+def add_matrix_counts_by_array(counts, cohorts, logins):
+    if len(cohorts) == 0:
+        return
+    player_ids = np.concatenate([ids.to_array() for _, ids in cohorts])
+    labels = np.concatenate(
+        [np.full(len(ids), index) for index, ids in cohorts])
+    for login_index, login_set in logins:
+        mask = np.isin(player_ids, login_set.to_array())
+        counts[:, login_index] += np.bincount(
+            labels[mask], minlength=len(counts))
+
+
+# player_id的集合: 玩家映射到新增日期，每个登录玩家只查找一次
+def add_matrix_counts_by_player(counts, cohorts, logins):
+    members = {}
+    for index, create_set in cohorts:
+        for player_id in create_set:
+            members.setdefault(player_id, []).append(index)
+    for login_index, login_set in logins:
+        login_counts = [0] * len(counts)
+        for player_id in login_set:
+            for index in members.get(player_id, ()):
+                login_counts[index] += 1
+        counts[:, login_index] += login_counts
 
 
 def compute_retention_track(time_str, login_map):
@@ -101,7 +223,7 @@ def compute_retention_track(time_str, login_map):
     end_date = util.get_some_day_of_one_day(
         time_str, -1)
     create_days = util.get_date_list(start_date, end_date)
-    create_map = PlayerIdMap()
+    create_map = new_player_id_map()
     ret = {}
     file_exist = util.get_players_multiple_days(
         bucket, CREATE_PLAYER_EVENT, S3_KEY_PREFIX_CREATE_PLAYER,
@@ -111,28 +233,22 @@ def compute_retention_track(time_str, login_map):
                     f" date start:{start_date}. "
                     f" date end:{end_date}. ")
         return ret
+    # 当天的登录作为矩阵的最后一列，一次算出所有新增日期的留存
+    days = create_days + [time_str]
+    day_indexes = {day: index for index, day in enumerate(days)}
     for platform, channels in create_map.player_id_map.items():
-        for channel, days in channels.items():
-            for day, create_set in days.items():
-                if len(create_set) == 0:
-                    continue
-                login_set, _ = login_map.get_all_day_player_ids(
-                    platform, channel)
-                count = get_retention_track(day, login_set, create_set)
-                ret[(day, platform, channel)] = count
+        for channel, create_sets in channels.items():
+            login_set, _ = login_map.get_all_day_player_ids(
+                platform, channel)
+            matrix = get_retention_matrix(
+                day_indexes, create_sets, {time_str: login_set})
+            for index, (counts, create_count) in matrix.items():
+                ret[(days[index], platform, channel)] = (
+                    counts[-1], create_count)
     logger.info(f"Compute retention track result:{ret}. ")
     return ret
 
 
-def get_retention_track(time_str, login_set, create_set):
-    ceate_size = len(create_set)
-    if ceate_size == 0:
-        return ()
-    intersection_set = create_set.intersection(login_set)
-    login_size = len(intersection_set)
-    return (login_size, ceate_size)
-
-
 def compute_retention(time_str, login_map, days):
     logger.info(
         f"Compute retention date:{time_str}. "
@@ -197,7 +313,7 @@ def get_date_path(event, day):
     if len(has_dates) != len(FILE_PATH_DATES):
         logger.error(f"{event} path error. path: {path}")
         raise RuntimeError()
-    d = (date.today() + timedelta(days=day))
+    d = (util.get_today() + timedelta(days=day))
     year = d.strftime("%Y")
     month = get_date_month(has_dates, d)
     day = get_date_day(has_dates, d)
@@ -211,25 +327,30 @@ def get_date_path(event, day):
 def output_to_es(time_str, retentions):
     if len(retentions) == 0:
         return
+    writer = es.BulkWriter()
     for key, values in retentions.items():
         if key == "retention":
             for day, rates in values.items():
                 for rate_key, rate_value in rates.items():
                     if rate_value:
                         es_add_rate_doc(
-                            rate_key[0], key + "_" + day, rate_key, rate_value)
+                            writer, rate_key[0], key + "_" + day, rate_key,
+                            rate_value)
+        elif key == RETENTION_MATRIX_KEY:
+            for ret_key, ret_value in values.items():
+                es_add_matrix_doc(writer, key, ret_key, ret_value)
         else:
             for ret_key, ret_value in values.items():
                 if ret_value:
-                    es_add_track_doc(time_str, key, ret_key, ret_value)
+                    es_add_track_doc(
+                        writer, time_str, key, ret_key, ret_value)
+    writer.close()
 
 
-def es_add_rate_doc(time_str, compute_type, ret_key, ret_value):
-    path = ES_INDEX + \
-        "/_doc/" + es_get_doc_id(
-            time_str, ret_key[1], ret_key[2], compute_type)
+def es_add_rate_doc(writer, time_str, compute_type, ret_key, ret_value):
+    doc_id = es_get_doc_id(time_str, ret_key[1], ret_key[2], compute_type)
     data = es_get_rate_doc(time_str, compute_type, ret_key, ret_value)
-    es.add_doc(path, data)
+    writer.add(ES_INDEX, doc_id, data)
 
 
 def es_get_rate_doc(time_str, compute_type, ret_key, ret_value):
@@ -245,10 +366,9 @@ def es_get_rate_doc(time_str, compute_type, ret_key, ret_value):
     return json.dumps(data)
 
 
-def es_add_track_doc(time_str, compute_type, ret_key, ret_value):
-    path = ES_INDEX + \
-        "/_doc/" + es_get_doc_id(
-            time_str, ret_key[1], ret_key[2], compute_type + "_" + ret_key[0])
+def es_add_track_doc(writer, time_str, compute_type, ret_key, ret_value):
+    doc_id = es_get_doc_id(
+        time_str, ret_key[1], ret_key[2], compute_type + "_" + ret_key[0])
     data = {
         "@timestamp": util.get_timestamp(time_str),
         "type": compute_type,
@@ -258,7 +378,20 @@ def es_add_track_doc(time_str, compute_type, ret_key, ret_value):
         "login_count": ret_value[0],
         "create_count": ret_value[1]
     }
-    es.add_doc(path, json.dumps(data))
+    writer.add(ES_INDEX, doc_id, data)
+
+
+def es_add_matrix_doc(writer, compute_type, ret_key, ret_value):
+    doc_id = es_get_doc_id(ret_key[0], ret_key[1], ret_key[2], compute_type)
+    data = {
+        "@timestamp": util.get_timestamp(ret_key[0]),
+        "type": compute_type,
+        "platform": ret_key[1],
+        "channel": ret_key[2],
+        "login_counts": ret_value[0],
+        "create_count": ret_value[1]
+    }
+    writer.add(ES_INDEX, doc_id, data)
 
 
 def es_get_doc_id(time_str, platform, channel, compute_type):
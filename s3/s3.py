@@ -25,4 +25,5 @@ def init_bucket_from_env():
     if os.environ.get(aws_secret_access_key_name) is not None:
         if util.is_empty(aws_secret_access_key):
             os.environ.pop("AWS_SECRET_ACCESS_KEY")
-    return boto3.resource("s3", AWS_REGION).Bucket(S3_BUCKET)
+    return boto3.resource(
+        "s3", AWS_REGION, config=util.get_s3_config()).Bucket(S3_BUCKET)
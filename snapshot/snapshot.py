@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+
+from model import new_player_id_map, PlayerIdDictionary
+
+# 本地目录或者s3://bucket/prefix，为空时不使用快照
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_EVENTS = os.getenv("SNAPSHOT_EVENTS", ",".join([
+    os.getenv("CREATE_PLAYER_EVENT", ""),
+    os.getenv("PLAYER_LOGIN_EVENT", "")]))
+# 日志写入s3有延迟，一天结束一段时间后才认为这一天的玩家不再变化
+SNAPSHOT_CLOSE_DELAY = int(os.getenv("SNAPSHOT_CLOSE_DELAY", 2 * 3600))
+SNAPSHOT_SUFFIX = ".json.gz"
+# 使用持久化的映射时保存整数id，小端的uint32数组
+SNAPSHOT_ARRAY_SUFFIX = ".ids.json.gz"
+ARRAY_DTYPE = np.dtype("<u4")
+S3_SCHEME = "s3://"
+COMMA = ","
+
+logger = logging.getLogger()
+
+s3_client = None
+
+
+def is_enabled(event):
+    if not SNAPSHOT_DIR or not SNAPSHOT_DIR.strip():
+        return False
+    return event in get_events()
+
+
+def get_events():
+    ret = set()
+    for event in SNAPSHOT_EVENTS.split(COMMA):
+        if event.strip():
+            ret.add(event.strip())
+    return ret
+
+
+# 日期按本地时区划分，时区不同的快照不能共用
+def get_name(event, s3_key_prefix, time_str):
+    # util导入了snapshot，这里使用时再导入
+    from util import util
+    key = f"{s3_key_prefix}_{time.timezone}_{time.altzone}_{time.tzname}"
+    if not util.is_empty(util.REPORT_TIMEZONE):
+        key = f"{s3_key_prefix}_{util.REPORT_TIMEZONE.strip()}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return "/".join([event, digest, time_str + SNAPSHOT_SUFFIX])
+
+
+# 整数id只对生成它的映射文件有效，文件的名字是路径的一部分
+def get_array_name(event, s3_key_prefix, time_str, dictionary):
+    name = get_name(event, s3_key_prefix, time_str)
+    dir_name, _, _ = name.rpartition("/")
+    return "/".join([dir_name, dictionary.name, time_str +
+                     SNAPSHOT_ARRAY_SUFFIX])
+
+
+# PlayerIdMap的集合是整数数组并且映射是持久化的
+def get_dictionary(player_map):
+    interner = getattr(player_map, "interner", None)
+    if isinstance(interner, PlayerIdDictionary) and interner.name:
+        return interner
+    return None
+
+
+def is_closed(end_time):
+    return time.time() > end_time + SNAPSHOT_CLOSE_DELAY
+
+
+def load(event, s3_key_prefix, time_str):
+    if not is_enabled(event):
+        return None
+    player_map = new_player_id_map()
+    dictionary = get_dictionary(player_map)
+    if dictionary is not None:
+        name = get_array_name(event, s3_key_prefix, time_str, dictionary)
+        channels_map = read_channels_map(name)
+        if channels_map is not None:
+            return load_arrays(
+                name, player_map, dictionary, time_str, channels_map)
+    name = get_name(event, s3_key_prefix, time_str)
+    channels_map = read_channels_map(name)
+    if channels_map is None:
+        return None
+    for platform, channels in channels_map.items():
+        for channel, player_ids in channels.items():
+            player_map.put_ids(time_str, platform, channel, player_ids)
+    logger.info(
+        f"Load snapshot. name: {name} ."
+        f"player size: {player_map.size()}")
+    return player_map
+
+
+def read_channels_map(name):
+    try:
+        data = read(name)
+        if data is None:
+            return None
+        return json.loads(gzip.decompress(data).decode("utf-8"))
+    except (OSError, ValueError, ClientError) as e:
+        logger.warn(f"Read snapshot error. name: {name} . error: {e}")
+        return None
+
+
+def load_arrays(name, player_map, dictionary, time_str, channels_map):
+    arrays = {}
+    max_index = -1
+    for platform, channels in channels_map.items():
+        for channel, value in channels.items():
+            values = np.frombuffer(
+                base64.b64decode(value), dtype=ARRAY_DTYPE)
+            if len(values) > 0:
+                max_index = max(max_index, int(values[-1]))
+            arrays[(platform, channel)] = values
+    # 快照可能由其他进程保存，先读取它追加的player_id
+    if max_index >= len(dictionary):
+        dictionary.refresh()
+    if max_index >= len(dictionary):
+        logger.warn(
+            f"Snapshot ids out of dictionary. name: {name} ."
+            f"dictionary size: {len(dictionary)}")
+        return None
+    for (platform, channel), values in arrays.items():
+        player_map.put_ids(
+            time_str, platform, channel, player_map.set_class.from_array(
+                values.astype(np.uint32), dictionary))
+    logger.info(
+        f"Load snapshot. name: {name} ."
+        f"player size: {player_map.size()}")
+    return player_map
+
+
+# 只保存已经结束的一天，end_time是这一天最后一秒的时间戳
+def save(event, s3_key_prefix, time_str, player_map, end_time):
+    if not is_enabled(event) or not is_closed(end_time):
+        return
+    # 读取player_id_map时才映射新的player_id，映射文件这时才有名字
+    player_id_map = player_map.player_id_map
+    dictionary = get_dictionary(player_map)
+    if dictionary is None:
+        name = get_name(event, s3_key_prefix, time_str)
+    else:
+        name = get_array_name(event, s3_key_prefix, time_str, dictionary)
+    channels_map = {}
+    for platform, channels in player_id_map.items():
+        for channel, days in channels.items():
+            player_ids = days.get(time_str)
+            if player_ids is None or len(player_ids) == 0:
+                continue
+            if dictionary is None:
+                value = sorted(player_ids)
+            else:
+                value = base64.b64encode(player_ids.to_array().astype(
+                    ARRAY_DTYPE).tobytes()).decode("ascii")
+            channels_map.setdefault(platform, {})[channel] = value
+    data = gzip.compress(json.dumps(channels_map).encode("utf-8"))
+    try:
+        write(name, data)
+    except (OSError, ClientError) as e:
+        logger.warn(f"Write snapshot error. name: {name} . error: {e}")
+        return
+    logger.info(
+        f"Save snapshot. name: {name} . bytes: {len(data)}")
+
+
+def read(name):
+    if is_s3():
+        bucket_name, key = get_s3_location(name)
+        try:
+            response = get_s3_client().get_object(
+                Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in (
+                    "NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read()
+    path = os.path.join(SNAPSHOT_DIR, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write(name, data):
+    if is_s3():
+        bucket_name, key = get_s3_location(name)
+        get_s3_client().put_object(Bucket=bucket_name, Key=key, Body=data)
+        return
+    path = os.path.join(SNAPSHOT_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + "." + str(os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def is_s3():
+    return SNAPSHOT_DIR.startswith(S3_SCHEME)
+
+
+def get_s3_location(name):
+    location = SNAPSHOT_DIR[len(S3_SCHEME):]
+    bucket_name, _, prefix = location.partition("/")
+    prefix = prefix.strip("/")
+    if prefix:
+        name = prefix + "/" + name
+    return bucket_name, name
+
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        s3_client = boto3.client("s3", os.getenv("AWS_REGION"))
+    return s3_client
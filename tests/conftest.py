@@ -0,0 +1,161 @@
+import hashlib
+import importlib
+import io
+import logging
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from eslog import eslog  # noqa: E402
+from model import (  # noqa: E402
+    PlayerIdMap, CompactPlayerIdMap, BitmapPlayerIdMap)
+from model.compact import PlayerIdInterner  # noqa: E402
+
+DAYS = ["2019-06-0" + str(day) for day in range(1, 9)]
+CHANNELS = [("ios", "appstore"), ("android", "googleplay")]
+
+
+# 计算脚本导入时会添加写es的handler，测试中去掉
+def load(name):
+    module = importlib.import_module(name)
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        if isinstance(handler, eslog.ESLogHandler):
+            logger.removeHandler(handler)
+    return module
+
+
+@pytest.fixture
+def load_script():
+    return load
+
+
+# 后端名 -> 返回(create_map, login_map)的函数
+# *_split的两个map使用不同的interner
+def get_backends():
+    def shared(map_class):
+        def create():
+            interner = PlayerIdInterner()
+            return map_class(interner), map_class(interner)
+        return create
+
+    def split(map_class):
+        def create():
+            return (map_class(PlayerIdInterner()),
+                    map_class(PlayerIdInterner()))
+        return create
+
+    return {
+        "set": lambda: (PlayerIdMap(), PlayerIdMap()),
+        "compact": shared(CompactPlayerIdMap),
+        "bitmap": shared(BitmapPlayerIdMap),
+        "compact_split": split(CompactPlayerIdMap),
+        "bitmap_split": split(BitmapPlayerIdMap)
+    }
+
+
+# 创建角色在第一天，登录分布在之后的日期，另有没有创建记录的登录
+def fill_maps(create_map, login_map, seed=7):
+    rnd = random.Random(seed)
+    for platform, channel in CHANNELS:
+        players = [platform + "_" + str(i) for i in range(300)]
+        for player_id in players[:200]:
+            create_map.put(DAYS[0], platform, channel, player_id)
+        for day in DAYS[1:]:
+            for player_id in rnd.sample(players, 120):
+                login_map.put(day, platform, channel, player_id)
+
+
+@pytest.fixture
+def backend_maps():
+    ret = {}
+    for name, create in get_backends().items():
+        create_map, login_map = create()
+        fill_maps(create_map, login_map)
+        ret[name] = (create_map, login_map)
+    return ret
+
+
+class FakeS3Client():
+    # 内存中的s3，list_objects_v2按key排序分页，支持Delimiter和StartAfter
+    def __init__(self, objects, max_keys=1000, encodings=None):
+        self.objects = objects
+        self.max_keys = max_keys
+        self.encodings = encodings or {}
+        self.lists = 0
+        self.gets = 0
+        self.meta = type("Meta", (), {"region_name": "fake"})()
+
+    def get_e_tag(self, key):
+        return '"' + hashlib.md5(self.objects[key]).hexdigest() + '"'
+
+    def get_object(self, Bucket, Key):
+        self.gets = self.gets + 1
+        return {
+            "Body": io.BytesIO(self.objects[Key]),
+            "ContentEncoding": self.encodings.get(Key)
+        }
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None,
+                        ContinuationToken=None, StartAfter=None):
+        self.lists = self.lists + 1
+        items = []
+        for key in sorted(self.objects):
+            if not key.startswith(Prefix):
+                continue
+            after = ContinuationToken or StartAfter
+            if after is not None and key <= after:
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefix = Prefix + rest[:rest.index(Delimiter) + 1]
+                if (prefix, True) not in items[-1:]:
+                    items.append((prefix, True))
+            else:
+                items.append((key, False))
+            if len(items) > self.max_keys:
+                break
+        page = items[:self.max_keys]
+        ret = {
+            "Contents": [
+                {"Key": key, "ETag": self.get_e_tag(key),
+                 "Size": len(self.objects[key])}
+                for key, is_prefix in page if not is_prefix],
+            "CommonPrefixes": [
+                {"Prefix": key} for key, is_prefix in page if is_prefix],
+            "IsTruncated": len(items) > self.max_keys
+        }
+        # 子目录作为最后一项时，下一页从这个子目录之后开始
+        if ret["IsTruncated"]:
+            key, is_prefix = page[-1]
+            ret["NextContinuationToken"] = key + (
+                chr(0x10ffff) if is_prefix else "")
+        return ret
+
+    def get_paginator(self, name):
+        return FakePaginator(self)
+
+
+class FakePaginator():
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            yield page
+            if not page["IsTruncated"]:
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+
+class FakeBucket():
+    def __init__(self, objects, name="log", **kwargs):
+        self.name = name
+        self.meta = type("Meta", (), {})()
+        self.meta.client = FakeS3Client(objects, **kwargs)
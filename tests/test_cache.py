@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from cache import cache
+from conftest import FakeS3Client
+from util import util
+
+KEY = "logs/2019/06/01/a.log"
+DAY = "2019-06-01"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "PARSE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(cache, "cache_bytes", None)
+    return tmp_path
+
+
+def new_log(event, player_id):
+    log_time = util.get_start_timestamp_time_str(DAY) + 3600
+    return (f'{log_time} {event} {{"player_id": "{player_id}", '
+            f'"platform": "ios", "channel": "appstore"}}\n')
+
+
+def new_object(client, key=KEY):
+    return util.S3Object(
+        client, "log", key, client.get_e_tag(key),
+        len(client.objects[key]))
+
+
+def test_cache_round_trip(cache_dir):
+    assert cache.get("a") is None
+    cache.put("a", {"x": {1, 2}})
+    assert cache.get("a") == {"x": {1, 2}}
+
+
+# 损坏的缓存文件当作不存在，并且删除
+def test_cache_broken_file(cache_dir):
+    cache.put("a", [1])
+    with open(cache.get_path("a"), "wb") as f:
+        f.write(b"broken")
+    assert cache.get("a") is None
+    assert not os.path.exists(cache.get_path("a"))
+
+
+# 超出上限后按修改时间淘汰，读取过的文件最后淘汰
+def test_cache_evict(cache_dir, monkeypatch):
+    value = b"x" * 1000
+    for i, name in enumerate(["a", "b", "c"]):
+        cache.put(name, value)
+        os.utime(cache.get_path(name), (i, i))
+    size = os.path.getsize(cache.get_path("a"))
+    monkeypatch.setattr(cache, "PARSE_CACHE_MAX_BYTES", size * 4 - 1)
+    monkeypatch.setattr(cache, "cache_bytes", None)
+    assert cache.get("a") == value
+    cache.put("d", value)
+    assert cache.get("b") is None
+    for name in ["a", "c", "d"]:
+        assert cache.get(name) == value
+    assert cache.cache_bytes == size * 3
+
+
+# 缓存key包含ETag，对象改变后重新解析，只解析没有缓存的事件
+def test_object_summary_cache(cache_dir):
+    client = FakeS3Client({KEY: (
+        new_log("EnterGame", "p1") + new_log("CreatePlayer", "p2")).encode()})
+    obj = new_object(client)
+    summary = util.get_object_summary(obj, ["EnterGame"])
+    assert summary["EnterGame"] == {(DAY, "ios", "appstore"): {"p1"}}
+    assert client.gets == 1
+
+    summary = util.get_object_summary(obj, ["EnterGame"])
+    assert client.gets == 1
+    summary = util.get_object_summary(obj, ["EnterGame", "CreatePlayer"])
+    assert client.gets == 2
+    assert summary["CreatePlayer"] == {(DAY, "ios", "appstore"): {"p2"}}
+    util.get_object_summary(obj, ["EnterGame", "CreatePlayer"])
+    assert client.gets == 2
+
+    client.objects[KEY] = new_log("EnterGame", "p3").encode()
+    summary = util.get_object_summary(new_object(client), ["EnterGame"])
+    assert summary["EnterGame"] == {(DAY, "ios", "appstore"): {"p3"}}
+    assert client.gets == 3
+
+
+def test_summary_name():
+    client = FakeS3Client({KEY: b"a", KEY + "2": b"a"})
+    obj = new_object(client)
+    other = new_object(client, KEY + "2")
+    assert util.get_summary_name(obj) != util.get_summary_name(other)
+    changed = util.S3Object(client, "log", KEY, '"other"', 1)
+    assert util.get_summary_name(obj) != util.get_summary_name(changed)
+    assert util.get_summary_name(obj).endswith(util.get_timezone_name())
+
+
+# 缓存的是整个对象的结果，开启缓存时不按时间过滤
+def test_parse_window_disabled_with_cache(cache_dir):
+    assert util.get_parse_window({DAY}) is None
+
+
+def test_parse_window_without_cache(monkeypatch):
+    monkeypatch.setattr(cache, "PARSE_CACHE_DIR", None)
+    assert util.get_parse_window({DAY}) == (
+        util.get_start_timestamp_time_str(DAY),
+        util.get_end_timestamp_time_str(DAY))
@@ -0,0 +1,28 @@
+from model import PlayerIdDictionary
+
+PLAYER_IDS = ["a", "b\nc", "d\\n", "\\", "e\n", "\n\\\n", "f"]
+
+
+# 包含换行和反斜杠的player_id重新加载后整数id不变
+def test_dictionary_round_trip(tmp_path):
+    path = str(tmp_path / "ids")
+    dictionary = PlayerIdDictionary(path)
+    indexes = dictionary.intern_all(PLAYER_IDS)
+    assert indexes == list(range(len(PLAYER_IDS)))
+
+    reloaded = PlayerIdDictionary(path)
+    assert len(reloaded) == len(PLAYER_IDS)
+    assert reloaded.player_ids == PLAYER_IDS
+    assert reloaded.intern_all(PLAYER_IDS) == indexes
+    assert reloaded.intern("g") == len(PLAYER_IDS)
+
+
+# 另一个进程追加的player_id在下次写入前读取
+def test_dictionary_shared_file(tmp_path):
+    path = str(tmp_path / "ids")
+    first = PlayerIdDictionary(path)
+    second = PlayerIdDictionary(path)
+    first.intern_all(PLAYER_IDS[:3])
+    assert second.intern("x\ny") == 3
+    assert second.player_ids[:3] == PLAYER_IDS[:3]
+    assert first.intern("x\ny") == 3
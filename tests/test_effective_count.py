@@ -0,0 +1,61 @@
+from conftest import DAYS
+
+
+def test_churn_rate_backends(load_script, backend_maps):
+    module = load_script("retention-effective-count")
+    results = {}
+    for name, (create_map, login_map) in backend_maps.items():
+        results[name] = module.compute_churn_rate(
+            create_map.get_total_player_ids(), login_map, DAYS[1:])
+    assert len(results["set"]) > 0
+    for name, result in results.items():
+        assert result == results["set"], name
+
+
+# 和按天取并集再求差集的结果一致
+def test_churn_rate_union(load_script, backend_maps):
+    module = load_script("retention-effective-count")
+    create_map, login_map = backend_maps["set"]
+    result = module.compute_churn_rate(
+        create_map.get_total_player_ids(), login_map, DAYS[1:])
+    for day in module.CHURN_DAYS.split(","):
+        for platform, channels in create_map.get_total_player_ids().items():
+            for channel, create_set in channels.items():
+                logins = set()
+                for login_day in DAYS[int(day):]:
+                    logins.update(login_map.get_some_day_player_ids(
+                        platform, channel, login_day)[0])
+                churn = len(create_set.difference(logins))
+                key = ("churn_rate_" + day + "_day", platform, channel)
+                assert result[key] == (churn, len(create_set))
+
+
+def test_effective_count_backends(load_script, backend_maps, monkeypatch):
+    module = load_script("retention-effective-count")
+    monkeypatch.setattr(module, "EFFECTIVE_EXTRA_DAYS", "4,6")
+    results = {}
+    for name, (create_map, login_map) in backend_maps.items():
+        results[name] = module.compute_effective_count(
+            create_map.get_total_player_ids(), login_map)
+    assert len(results["set"]) > 0
+    for name, result in results.items():
+        assert result == results["set"], name
+
+
+# 登录天数加上创建的那天不少于阈值的新增玩家数
+def test_effective_count_days(load_script, backend_maps):
+    module = load_script("retention-effective-count")
+    create_map, login_map = backend_maps["set"]
+    result = module.compute_effective_count(
+        create_map.get_total_player_ids(), login_map)
+    for platform, channels in create_map.get_total_player_ids().items():
+        for channel, create_set in channels.items():
+            counts = {player_id: 1 for player_id in create_set}
+            for day in DAYS[1:]:
+                for player_id in login_map.get_some_day_player_ids(
+                        platform, channel, day)[0]:
+                    if player_id in counts:
+                        counts[player_id] = counts[player_id] + 1
+            for key, days in module.get_effective_thresholds():
+                effective = len([c for c in counts.values() if c >= days])
+                assert result[(key, platform, channel)] == effective
@@ -0,0 +1,56 @@
+import gzip
+import io
+
+import pytest
+
+from conftest import FakeS3Client
+from util import util
+
+LINES = ["a 1\n", "b 2\n", "c 3\n"]
+DATA = "".join(LINES).encode("utf-8")
+
+
+@pytest.mark.parametrize("key,content_encoding,expected", [
+    ("a.log", None, None),
+    ("a.log.gz", None, util.ENCODING_GZIP),
+    ("a.log.gzip", "", util.ENCODING_GZIP),
+    ("a.log.zst", None, util.ENCODING_ZSTD),
+    ("a.log.zstd", None, util.ENCODING_ZSTD),
+    ("a.log", " GZIP ", util.ENCODING_GZIP),
+    ("a.log.gz", "zstd", util.ENCODING_ZSTD),
+    ("a.log.zst", "identity", util.ENCODING_ZSTD),
+])
+def test_get_encoding(key, content_encoding, expected):
+    assert util.get_encoding(key, content_encoding) == expected
+
+
+def read_keys(objects, encodings=None):
+    client = FakeS3Client(objects, encodings=encodings)
+    ret = {}
+    for key in objects:
+        obj = util.S3Object(client, "log", key, client.get_e_tag(key), 0)
+        ret[key] = list(util.read_lines(obj))
+    return ret
+
+
+def test_read_lines_gzip():
+    body = gzip.compress(DATA)
+    objects = {"a.log": DATA, "b.log.gz": body, "c.log": body}
+    ret = read_keys(objects, {"c.log": "gzip"})
+    assert ret == {key: LINES for key in objects}
+
+
+# 多个frame拼接的zstd文件全部读出
+def test_read_lines_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    body = compressor.compress(DATA[:4]) + compressor.compress(DATA[4:])
+    objects = {"a.log.zst": body, "b.log": body}
+    ret = read_keys(objects, {"b.log": "zstd"})
+    assert ret == {key: LINES for key in objects}
+
+
+def test_zstd_not_installed(monkeypatch):
+    monkeypatch.setattr(util, "zstandard", None)
+    with pytest.raises(RuntimeError):
+        util.get_decompressed_body("a.log.zst", None, io.BytesIO(b""))
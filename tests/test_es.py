@@ -0,0 +1,55 @@
+import pytest
+
+from es import es
+
+FIELD = "tags.player_id"
+INDEX = "gperf-index-2019.06.01"
+
+
+def new_hit(tags):
+    source = {"device": {"vendor": "v", "model": "m"}}
+    if tags is not None:
+        source["tags"] = tags
+    return {"_source": source}
+
+
+@pytest.fixture
+def terms_hits(monkeypatch):
+    hits = []
+    queries = []
+
+    def scroll_pages(index, data, slices=None):
+        queries.append(data)
+        yield hits
+    monkeypatch.setattr(es, "scroll_pages", scroll_pages)
+    monkeypatch.setattr(es, "terms_cache", {})
+    return hits, queries
+
+
+# 缺少字段，字段是对象的文档忽略，数组字段按每个值对应
+def test_sources_by_terms_field_values(terms_hits):
+    hits, queries = terms_hits
+    hits.extend([
+        new_hit({"player_id": "p1"}),
+        new_hit(None),
+        new_hit({"other": "p2"}),
+        new_hit({"player_id": {"id": "p3"}}),
+        new_hit({"player_id": ["p4", "p5", {"id": "p6"}]}),
+        new_hit("p7")
+    ])
+    ret = es.get_sources_by_terms(
+        INDEX, FIELD, ["p1", "p2", "p3", "p4", "p5"], [FIELD],
+        FIELD + ".keyword")
+    assert sorted(ret) == ["p1", "p4", "p5"]
+    assert ret["p4"] is ret["p5"]
+    assert '"tags.player_id.keyword"' in queries[0]
+
+
+# 查询过的值不再查询，没有文档的值也会缓存
+def test_sources_by_terms_cache(terms_hits):
+    hits, queries = terms_hits
+    hits.append(new_hit({"player_id": "p1"}))
+    es.get_sources_by_terms(INDEX, FIELD, ["p1", "p2"], [FIELD])
+    ret = es.get_sources_by_terms(INDEX, FIELD, ["p1", "p2"], [FIELD])
+    assert list(ret) == ["p1"]
+    assert len(queries) == 1
@@ -0,0 +1,38 @@
+import logging
+
+from es import es
+from eslog import eslog
+
+
+def new_record(message):
+    return logging.LogRecord(
+        "test", logging.INFO, __file__, 1, message, None, None)
+
+
+# 写入es时产生的日志不会丢失，下次flush时写入
+def test_flush_keeps_logs_emitted_while_writing(monkeypatch):
+    handler = eslog.ESLogHandler("test")
+    batches = []
+
+    def batch_add_doc(index, data):
+        batches.append(data)
+        handler.handle(new_record("during output " + str(len(batches))))
+    monkeypatch.setattr(es, "batch_add_doc", batch_add_doc)
+
+    handler.handle(new_record("first"))
+    handler.flush()
+    assert len(batches) == 1
+    assert "first" in batches[0]
+    assert len(handler.to_es_logs) == 1
+
+    handler.flush()
+    assert len(batches) == 2
+    assert "during output 1" in batches[1]
+    assert "first" not in batches[1]
+
+
+def test_flush_empty(monkeypatch):
+    handler = eslog.ESLogHandler("test")
+    monkeypatch.setattr(es, "batch_add_doc", None)
+    handler.flush()
+    assert handler.to_es_logs == []
@@ -0,0 +1,82 @@
+import random
+import string
+
+import pytest
+
+from conftest import FakeBucket
+from util import util
+
+PREFIX = "logs/2019/06/01/"
+
+
+def new_objects(seed=3):
+    rnd = random.Random(seed)
+    chars = string.ascii_letters + string.digits + "-_."
+    objects = {}
+    for _ in range(600):
+        name = "".join(rnd.choice(chars) for _ in range(rnd.randint(1, 8)))
+        objects[PREFIX + name] = name.encode("utf-8")
+    for i in range(20):
+        objects[PREFIX + "d" + str(i) + "/a.log"] = b"a"
+        objects[PREFIX + "d" + str(i) + "/b/c.log"] = b"c"
+    objects["logs/2019/06/02/x.log"] = b"x"
+    return objects
+
+
+def list_keys(bucket, filter_prefix):
+    objs = util.list_prefix(bucket.meta.client, bucket.name, filter_prefix)
+    return [obj.key for obj in objs]
+
+
+def get_expected(objects, filter_prefix):
+    return sorted(key for key in objects if key.startswith(filter_prefix))
+
+
+@pytest.mark.parametrize("workers,split_pages", [
+    (1, 0), (4, 0), (1, 1), (4, 1), (4, 3)])
+def test_list_prefix(monkeypatch, workers, split_pages):
+    monkeypatch.setattr(util, "S3_MAX_WORKERS", workers)
+    monkeypatch.setattr(util, "S3_LIST_SPLIT_PAGES", split_pages)
+    objects = new_objects()
+    bucket = FakeBucket(objects, max_keys=50)
+    assert list_keys(bucket, PREFIX) == get_expected(objects, PREFIX)
+
+
+# 不分段时和逐页列出的请求数相同，分段最多每段多一次请求
+def test_list_split_requests(monkeypatch):
+    objects = {PREFIX + str(i).zfill(4): b"x" for i in range(1000)}
+    monkeypatch.setattr(util, "S3_MAX_WORKERS", 4)
+    monkeypatch.setattr(util, "S3_LIST_SPLIT_PAGES", 0)
+    bucket = FakeBucket(objects, max_keys=100)
+    assert list_keys(bucket, PREFIX) == get_expected(objects, PREFIX)
+    assert bucket.meta.client.lists == 10
+
+    monkeypatch.setattr(util, "S3_LIST_SPLIT_PAGES", 2)
+    bucket = FakeBucket(objects, max_keys=100)
+    assert list_keys(bucket, PREFIX) == get_expected(objects, PREFIX)
+    ranges = util.get_list_ranges(PREFIX, PREFIX + "0199")
+    assert bucket.meta.client.lists <= 10 + len(ranges)
+
+
+# 分段的边界之间的key属于同一段，子目录不会重复
+def test_list_ranges():
+    ranges = util.get_list_ranges(PREFIX, PREFIX + "5")
+    assert ranges[0] == (PREFIX + "5", PREFIX + "7")
+    assert ranges[-1][1] is None
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    assert all(util.S3_DELIMITER not in start[len(PREFIX):]
+               for start, _ in ranges[1:])
+
+
+# 列出过的前缀之下的前缀直接从结果中过滤，不再请求
+def test_list_objects_reuse(monkeypatch):
+    monkeypatch.setattr(util, "listed_objects", {})
+    objects = new_objects()
+    bucket = FakeBucket(objects, max_keys=50)
+    util.list_objects(bucket, PREFIX)
+    lists = bucket.meta.client.lists
+    sub_prefix = PREFIX + "d1"
+    objs = util.list_objects(bucket, sub_prefix)
+    assert [obj.key for obj in objs] == get_expected(objects, sub_prefix)
+    assert bucket.meta.client.lists == lists
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from util import util
+
+
+class Counter():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def run(self):
+        with self.lock:
+            self.running = self.running + 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running = self.running - 1
+
+
+# 结果和输入的顺序一致
+def test_map_objects_order(monkeypatch):
+    monkeypatch.setattr(util, "S3_MAX_WORKERS", 4)
+    ret = util.map_objects(lambda obj, n: obj * n, list(range(20)), 3)
+    assert ret == [obj * 3 for obj in range(20)]
+
+
+# 工作线程中的map_objects串行执行，同时执行的不超过S3_MAX_WORKERS
+def test_map_objects_nested(monkeypatch):
+    monkeypatch.setattr(util, "S3_MAX_WORKERS", 4)
+    counter = Counter()
+
+    def inner(obj):
+        counter.run()
+        return obj
+
+    def outer(obj):
+        return util.map_objects(inner, [obj] * 4)
+
+    ret = util.map_objects(outer, list(range(8)))
+    assert ret == [[obj] * 4 for obj in range(8)]
+    assert counter.max_running <= 4
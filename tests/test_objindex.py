@@ -0,0 +1,97 @@
+import pytest
+
+from cache import cache
+from conftest import FakeBucket, FakeS3Client
+from model import factory
+from objindex import objindex
+from util import util
+
+EVENT = "EnterGame"
+PREFIX = "logs/2019/06/01/"
+DAY = "2019-06-01"
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(objindex, "OBJECT_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(objindex, "manifests", {})
+    monkeypatch.setattr(objindex, "pending", [])
+    monkeypatch.setattr(cache, "PARSE_CACHE_DIR", None)
+    monkeypatch.setattr(util, "PARSE_PROCESSES", 1)
+    monkeypatch.setattr(util, "listed_objects", {})
+    return tmp_path
+
+
+def new_log(log_time, event, player_id):
+    return (f'{log_time} {event} {{"player_id": "{player_id}", '
+            f'"platform": "ios", "channel": "appstore"}}\n')
+
+
+def new_object(client, key):
+    return util.S3Object(
+        client, "log", key, client.get_e_tag(key), len(client.objects[key]))
+
+
+# 重新加载清单，和新的进程一样
+def reload_manifests(monkeypatch):
+    monkeypatch.setattr(objindex, "manifests", {})
+
+
+def test_may_contain(index_dir, monkeypatch):
+    key = PREFIX + "a.log"
+    client = FakeS3Client({key: b"a", PREFIX + "b.log": b"b"})
+    obj = new_object(client, key)
+    entry = objindex.new_entry(obj)
+    for line in [new_log(100, EVENT, "p1"), new_log(200, EVENT, "p2"),
+                 new_log(300, "CreatePlayer", "p1"), "broken\n"]:
+        objindex.add_line(entry, util.split_line(line))
+    assert entry["lines"] == 4
+    assert entry["events"][EVENT] == {
+        "count": 2, "min_time": 100, "max_time": 200}
+    objindex.record(obj, entry)
+    objindex.save()
+    assert objindex.take_pending() == []
+    reload_manifests(monkeypatch)
+
+    assert objindex.may_contain(obj, EVENT, [(150, 160)])
+    assert objindex.may_contain(obj, EVENT, [(0, 50), (200, 250)])
+    assert not objindex.may_contain(obj, EVENT, [(201, 300)])
+    assert not objindex.may_contain(obj, "Login", [(0, 300)])
+    # 没有索引的对象和ETag改变的对象都当作可能包含
+    assert objindex.may_contain(
+        new_object(client, PREFIX + "b.log"), "Login", [(0, 1)])
+    changed = util.S3Object(client, "log", key, '"other"', 1)
+    assert objindex.get(changed) is None
+    assert objindex.may_contain(changed, "Login", [(0, 1)])
+
+
+def test_filter_objects_disabled(monkeypatch):
+    monkeypatch.setattr(objindex, "OBJECT_INDEX_DIR", None)
+    objs = [object()]
+    assert objindex.filter_objects(objs, EVENT, 0, 1) is objs
+
+
+# 第一次解析时记录索引，之后不包含事件或时间范围的对象不再读取
+def test_add_player_skips_objects(index_dir, monkeypatch):
+    start_time = util.get_start_timestamp_time_str(DAY)
+    end_time = util.get_end_timestamp_time_str(DAY)
+    objects = {
+        PREFIX + "a.log": new_log(start_time + 10, EVENT, "p1").encode(),
+        PREFIX + "b.log": new_log(
+            start_time + 10, "CreatePlayer", "p2").encode(),
+        PREFIX + "c.log": new_log(end_time + 10, EVENT, "p3").encode()
+    }
+    bucket = FakeBucket(objects)
+    players = factory.new_player_id_map()
+    util.add_player(
+        bucket, players, "CreatePlayer", PREFIX, start_time, end_time)
+    assert bucket.meta.client.gets == 3
+    assert len(list(index_dir.rglob("*" + objindex.OBJECT_INDEX_SUFFIX))) == 1
+
+    reload_manifests(monkeypatch)
+    monkeypatch.setattr(util, "listed_objects", {})
+    bucket = FakeBucket(objects)
+    players = factory.new_player_id_map()
+    util.add_player(bucket, players, EVENT, PREFIX, start_time, end_time)
+    assert bucket.meta.client.gets == 1
+    assert players.get_total_player_ids() == {"ios": {"appstore": {"p1"}}}
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from conftest import CHANNELS, get_backends
+from util import util
+from model import factory
+
+CREATE_PLAYER_EVENT = "CreatePlayer"
+PLAYER_LOGIN_EVENT = "EnterGame"
+CREATE_PREFIX = "create/<yyyy>/<MM>/<dd>/"
+LOGIN_PREFIX = "login/<yyyy>/<MM>/<dd>/"
+MATRIX_DAYS = 8
+
+
+# 每天都有新增和登录，登录的玩家从之前所有新增中随机选
+def preload_days(time_strs, seed=11):
+    rnd = random.Random(seed)
+    players = []
+    for index, time_str in enumerate(time_strs):
+        create_map = factory.new_player_id_map()
+        login_map = factory.new_player_id_map()
+        for platform, channel in CHANNELS:
+            for i in range(50):
+                player_id = f"{platform}_{index}_{i}"
+                players.append((platform, channel, player_id))
+                create_map.put(time_str, platform, channel, player_id)
+        for platform, channel, player_id in rnd.sample(
+                players, len(players) // 2):
+            login_map.put(time_str, platform, channel, player_id)
+        util.preloaded_players[
+            (CREATE_PLAYER_EVENT, CREATE_PREFIX, time_str)] = (
+                create_map, True)
+        util.preloaded_players[
+            (PLAYER_LOGIN_EVENT, LOGIN_PREFIX, time_str)] = (login_map, True)
+
+
+@pytest.fixture
+def retention(load_script, monkeypatch):
+    module = load_script("retention")
+    monkeypatch.setattr(module, "CREATE_PLAYER_EVENT", CREATE_PLAYER_EVENT)
+    monkeypatch.setattr(module, "PLAYER_LOGIN_EVENT", PLAYER_LOGIN_EVENT)
+    monkeypatch.setattr(module, "S3_KEY_PREFIX_CREATE_PLAYER", CREATE_PREFIX)
+    monkeypatch.setattr(module, "S3_KEY_PREFIX_PLAYER_LOGIN", LOGIN_PREFIX)
+    monkeypatch.setattr(module, "RETENTION_DAYS", "2,3,5,8")
+    monkeypatch.setattr(module, "RETENTION_MATRIX_DAYS", MATRIX_DAYS)
+    monkeypatch.setattr(util, "preloaded_players", {})
+    return module
+
+
+# 矩阵中新增日期之后第n-1天的登录人数就是这一天的dayn留存
+@pytest.mark.parametrize("backend", ["set", "compact", "bitmap"])
+def test_matrix_matches_retention(retention, monkeypatch, backend):
+    monkeypatch.setattr(factory, "PLAYER_ID_MAP_BACKEND", backend)
+    time_str = util.get_some_day(-2)
+    time_strs = retention.get_matrix_days(time_str)
+    preload_days(time_strs)
+    # 矩阵之前的新增日期没有玩家
+    for days in range(1, MATRIX_DAYS):
+        util.preloaded_players[(
+            CREATE_PLAYER_EVENT, CREATE_PREFIX,
+            util.get_some_day_of_one_day(time_strs[0], -days))] = (
+                factory.new_player_id_map(), True)
+    matrix = retention.compute_retention_matrix(time_str)
+    assert len(matrix) == MATRIX_DAYS * len(CHANNELS)
+    checked = 0
+    for login_day in time_strs:
+        days = util.days_compute(util.get_some_day(0), login_day)
+        login_map, _ = util.get_players(
+            None, PLAYER_LOGIN_EVENT, LOGIN_PREFIX, days)
+        result = retention.compute_retention(login_day, login_map, days)
+        for key, values in result.items():
+            offset = int(key[len(retention.RETENTION_DAY_PREFIX):]) - 1
+            for (create_day, platform, channel), value in values.items():
+                counts, create_count = matrix[
+                    (create_day, platform, channel)]
+                assert counts[offset] == value[0]
+                assert create_count == value[1]
+                checked = checked + 1
+    assert checked > 0
+
+
+def test_matrix_backends(retention):
+    day_indexes = {"2019-06-01": 0, "2019-06-02": 1, "2019-06-03": 2}
+    results = {}
+    for name, create in get_backends().items():
+        create_map, login_map = create()
+        rnd = random.Random(5)
+        for index, day in enumerate(day_indexes):
+            for i in range(40):
+                create_map.put(day, "ios", "appstore", f"{index}_{i}")
+            for i in range(40):
+                login_map.put(
+                    day, "ios", "appstore",
+                    f"{rnd.randrange(index + 1)}_{rnd.randrange(40)}")
+        results[name] = retention.get_retention_matrix(
+            day_indexes, create_map.player_id_map["ios"]["appstore"],
+            login_map.player_id_map["ios"]["appstore"])
+    for name, result in results.items():
+        assert result == results["set"], name
+
+
+# 每个新增日期的留存等于新增玩家和当天登录玩家的交集
+@pytest.mark.parametrize("backend", ["set", "compact", "bitmap"])
+def test_retention_track(retention, monkeypatch, backend):
+    monkeypatch.setattr(factory, "PLAYER_ID_MAP_BACKEND", backend)
+    monkeypatch.setattr(retention, "RETENTION_TRACK_DAYS", 5)
+    time_str = util.get_some_day(-2)
+    time_strs = util.get_date_list(
+        util.get_some_day_of_one_day(time_str, -6), time_str)
+    preload_days(time_strs)
+    login_map, _ = util.get_players(
+        None, PLAYER_LOGIN_EVENT, LOGIN_PREFIX, -2)
+    result = retention.compute_retention_track(time_str, login_map)
+    assert len(result) == 6 * len(CHANNELS)
+    for (day, platform, channel), value in result.items():
+        create_map, _ = util.preloaded_players[
+            (CREATE_PLAYER_EVENT, CREATE_PREFIX, day)]
+        create_set, _ = create_map.get_some_day_player_ids(
+            platform, channel, day)
+        login_set = login_map.get_all_day_player_ids(platform, channel)[0]
+        assert value == (
+            len(set(create_set) & set(login_set)), len(create_set))
@@ -0,0 +1,180 @@
+import os
+import time
+
+import pytest
+
+from conftest import FakeBucket
+from model import factory, PlayerIdDictionary
+from snapshot import snapshot
+from util import util
+
+EVENT = "EnterGame"
+PREFIX = "logs/<yyyy>/<MM>/<dd>/"
+DAY = "2019-06-01"
+PLAYERS = {
+    ("ios", "appstore"): ["a", "b", "c\nd"],
+    ("android", "googleplay"): ["e", "a"]
+}
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+    monkeypatch.setattr(snapshot, "SNAPSHOT_EVENTS", EVENT)
+    return tmp_path
+
+
+# 每次运行重新打开映射文件，和新的进程一样
+def use_backend(monkeypatch, backend, path=None):
+    monkeypatch.setattr(factory, "PLAYER_ID_MAP_BACKEND", backend)
+    monkeypatch.setattr(factory, "PLAYER_ID_DICTIONARY", path)
+    monkeypatch.setattr(factory, "dictionary", None)
+
+
+def new_map():
+    player_map = factory.new_player_id_map()
+    for (platform, channel), player_ids in PLAYERS.items():
+        for player_id in player_ids:
+            player_map.put(DAY, platform, channel, player_id)
+    return player_map
+
+
+def get_players(player_map):
+    ret = {}
+    for platform, channels in player_map.player_id_map.items():
+        for channel, days in channels.items():
+            ret[(platform, channel)] = sorted(days[DAY])
+    return ret
+
+
+def list_files(path):
+    ret = []
+    for dir_name, _, file_names in os.walk(path):
+        ret.extend(os.path.join(dir_name, name) for name in file_names)
+    return ret
+
+
+@pytest.mark.parametrize("backend", ["set", "compact", "bitmap"])
+def test_snapshot_round_trip(snapshot_dir, monkeypatch, backend):
+    use_backend(monkeypatch, backend)
+    snapshot.save(EVENT, PREFIX, DAY, new_map(), 0)
+    player_map = snapshot.load(EVENT, PREFIX, DAY)
+    expected = {key: sorted(ids) for key, ids in PLAYERS.items()}
+    assert get_players(player_map) == expected
+
+
+# 使用持久化映射的位图保存整数id，下次运行直接加载
+def test_snapshot_dictionary_arrays(snapshot_dir, monkeypatch):
+    path = str(snapshot_dir / "dictionary")
+    use_backend(monkeypatch, "bitmap", path)
+    snapshot.save(EVENT, PREFIX, DAY, new_map(), 0)
+    files = list_files(snapshot.SNAPSHOT_DIR)
+    assert len(files) == 1
+    assert files[0].endswith(snapshot.SNAPSHOT_ARRAY_SUFFIX)
+
+    use_backend(monkeypatch, "bitmap", path)
+    player_map = snapshot.load(EVENT, PREFIX, DAY)
+    interner = factory.get_interner()
+    for days in player_map.player_id_map["ios"].values():
+        assert days[DAY].interner is interner
+    expected = {key: sorted(ids) for key, ids in PLAYERS.items()}
+    assert get_players(player_map) == expected
+
+
+# 映射文件重建后整数id不同，旧的快照不能使用
+def test_snapshot_other_dictionary(snapshot_dir, monkeypatch):
+    use_backend(monkeypatch, "bitmap", str(snapshot_dir / "dictionary"))
+    snapshot.save(EVENT, PREFIX, DAY, new_map(), 0)
+    other = str(snapshot_dir / "other")
+    PlayerIdDictionary(other).intern_all(["z", "e", "a"])
+    use_backend(monkeypatch, "bitmap", other)
+    assert snapshot.load(EVENT, PREFIX, DAY) is None
+
+
+def new_log(time_str, event, player_id):
+    log_time = util.get_start_timestamp_time_str(time_str) + 12 * 3600
+    return (f'{log_time} {event} {{"player_id": "{player_id}", '
+            f'"platform": "ios", "channel": "appstore"}}\n')
+
+
+# 文件存在但是没有这个事件的日期保存空的快照，下次不再扫描
+def test_snapshot_empty_days(snapshot_dir, monkeypatch):
+    use_backend(monkeypatch, "set")
+    monkeypatch.setattr(util, "listed_objects", {})
+    monkeypatch.setattr(util, "preloaded_players", {})
+    days = ["2019-06-01", "2019-06-02", "2019-06-05"]
+    objects = {
+        "logs/2019/06/01/a.log": (new_log(days[0], EVENT, "p1") +
+                                  new_log(days[0], EVENT, "p2")).encode(),
+        "logs/2019/06/02/a.log": new_log(
+            days[1], "CreatePlayer", "p3").encode()
+    }
+    bucket = FakeBucket(objects)
+    players = factory.new_player_id_map()
+    assert util.get_players_multiple_days(
+        bucket, EVENT, PREFIX, days, players)
+    assert players.get_days() == {days[0]}
+    names = sorted(os.path.basename(name)
+                   for name in list_files(snapshot.SNAPSHOT_DIR))
+    assert names == [day + snapshot.SNAPSHOT_SUFFIX for day in days[:2]]
+    assert snapshot.load(EVENT, PREFIX, days[1]).size() == 0
+
+    monkeypatch.setattr(util, "listed_objects", {})
+    bucket = FakeBucket(objects)
+    players = factory.new_player_id_map()
+    assert util.get_players_multiple_days(
+        bucket, EVENT, PREFIX, days, players)
+    assert sorted(players.get_total_player_ids()["ios"]["appstore"]) == [
+        "p1", "p2"]
+    assert bucket.meta.client.gets == 0
+
+
+def test_snapshot_is_enabled(snapshot_dir, monkeypatch):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_EVENTS", f" {EVENT} ,Login,")
+    assert snapshot.is_enabled(EVENT)
+    assert snapshot.is_enabled("Login")
+    assert not snapshot.is_enabled("CreatePlayer")
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", " ")
+    assert not snapshot.is_enabled(EVENT)
+
+
+# 一天结束后超过延迟时间才保存快照，之前的日志可能还没有写入
+def test_snapshot_closed_day(snapshot_dir, monkeypatch):
+    use_backend(monkeypatch, "set")
+    monkeypatch.setattr(snapshot, "SNAPSHOT_CLOSE_DELAY", 3600)
+    now = time.time()
+    snapshot.save(EVENT, PREFIX, DAY, new_map(), now)
+    snapshot.save(EVENT, PREFIX, DAY, new_map(), now - 3000)
+    assert snapshot.load(EVENT, PREFIX, DAY) is None
+    snapshot.save(EVENT, PREFIX, DAY, new_map(), now - 3700)
+    assert snapshot.load(EVENT, PREFIX, DAY).size() > 0
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_CLOSE_DELAY", 0)
+    snapshot.save(EVENT, PREFIX, "2019-06-02", new_map(), now - 1)
+    assert snapshot.load(EVENT, PREFIX, "2019-06-02") is not None
+
+
+# 今天的玩家每次重新扫描，结束的日期之后直接读取快照
+def test_get_players_snapshot(snapshot_dir, monkeypatch):
+    use_backend(monkeypatch, "set")
+    monkeypatch.setattr(util, "listed_objects", {})
+    monkeypatch.setattr(util, "preloaded_players", {})
+    objects = {}
+    for day in [0, -3]:
+        time_str = util.get_some_day(day)
+        key = util.get_prefix(PREFIX, day) + "a.log"
+        objects[key] = new_log(time_str, EVENT, "p" + str(day)).encode()
+    for day in [0, -3]:
+        player_map, exist = util.get_players(
+            FakeBucket(objects), EVENT, PREFIX, day)
+        assert exist and player_map.size() == 1
+    assert snapshot.load(EVENT, PREFIX, util.get_some_day(0)) is None
+
+    monkeypatch.setattr(util, "listed_objects", {})
+    bucket = FakeBucket(objects)
+    player_map, exist = util.get_players(bucket, EVENT, PREFIX, -3)
+    assert exist
+    assert player_map.get_total_player_ids() == {
+        "ios": {"appstore": {"p-3"}}}
+    assert bucket.meta.client.lists == 0
+    assert bucket.meta.client.gets == 0
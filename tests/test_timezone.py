@@ -0,0 +1,65 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from util import util
+
+PREFIX = "logs/<yyyy>/<MM>/<dd>/<HH>/"
+
+
+@pytest.fixture
+def report_timezone(monkeypatch):
+    pytest.importorskip("zoneinfo")
+
+    def set_timezone(timezone):
+        monkeypatch.setattr(util, "REPORT_TIMEZONE", timezone)
+        util.get_report_timezone.cache_clear()
+
+    yield set_timezone
+    util.get_report_timezone.cache_clear()
+
+
+@pytest.fixture
+def today(monkeypatch):
+    monkeypatch.setattr(util, "get_today", lambda: date(2019, 6, 1))
+
+
+# 从2019-05-31 00:00 utc开始的第start个小时起，连续count个小时的前缀
+def get_hours(start, count):
+    ret = []
+    for i in range(count):
+        d = datetime(2019, 5, 31) + timedelta(hours=start + i)
+        ret.append(d.strftime("logs/%Y/%m/%d/%H/"))
+    return ret
+
+
+# 时区不是整小时时，一天的开始和结束在同一个utc小时内，共25个前缀
+@pytest.mark.parametrize("timezone,expected", [
+    ("Asia/Shanghai", get_hours(16, 24)),
+    ("Asia/Kolkata", get_hours(18, 25)),
+    ("Asia/Kathmandu", get_hours(18, 25)),
+    ("America/St_Johns", get_hours(26, 25)),
+    ("UTC", get_hours(24, 24)),
+])
+def test_get_hour_paths(report_timezone, today, timezone, expected):
+    report_timezone(timezone)
+    assert util.get_hour_paths(PREFIX, 0) == expected
+    assert util.get_date_paths(PREFIX, 0) == expected
+
+
+def test_get_date_paths(report_timezone, today):
+    report_timezone("Asia/Kolkata")
+    assert util.get_date_paths("logs/<yyyy>/<MM>/<dd>/", 0) == [
+        "logs/2019/05/31/", "logs/2019/06/01/"]
+    report_timezone("UTC")
+    assert util.get_date_paths("logs/<yyyy>/<MM>/<dd>/", 0) == [
+        "logs/2019/06/01/"]
+
+
+# 今天按REPORT_TIMEZONE计算，和本机时区无关
+def test_get_today(report_timezone):
+    report_timezone("Pacific/Kiritimati")
+    east = util.get_today()
+    report_timezone("Pacific/Pago_Pago")
+    west = util.get_today()
+    assert (east - west).days in (1, 2)
@@ -1,17 +1,41 @@
 #!/usr/bin/env python3
 import logging
 import os
+import sys
 import json
+import threading
 import time
 from datetime import datetime, date, timedelta
 import encodings
+import gzip
+import types
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import boto3
+from botocore.config import Config
 from multipledispatch import dispatch
 from collections import Counter
+from functools import lru_cache
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    try:
+        from backports.zoneinfo import ZoneInfo
+    except ImportError:
+        ZoneInfo = None
 
-from model import PlayerIdMap
+from model import PlayerIdMap, new_player_id_map
+from cache import cache
+from snapshot import snapshot
+from objindex import objindex
 
 ARG_DATE_FORMAT = "%Y-%m-%d"
 INVALID_VALUE = -1
+# 时区偏移最小单位是15分钟，同一个15分钟内的本地日期相同
+LOCAL_DAY_INTERVAL = 900
 YEAR = "year"
 MONTH = "month"
 DAY = "day"
@@ -21,10 +45,42 @@ FILE_PATH_DATES = {
     DAY: ["<dd>", "<d>"]
 }
 FILE_PATH_DOUBLE_DIGITS_DATE = {"<MM>", "<dd>"}
+# 按utc小时分区的前缀，只读取和本地日期有重叠的小时
+FILE_PATH_HOUR = "<HH>"
+ONE_HOUR = 3600
+# 统计日期使用的时区，例如Asia/Shanghai，为空时使用本机时区
+REPORT_TIMEZONE = os.getenv("REPORT_TIMEZONE", "")
+# 并发下载解析s3对象的线程数，1表示串行
+S3_MAX_WORKERS = int(os.getenv("S3_MAX_WORKERS", 1))
+# 解析s3对象的进程数，1表示在当前进程解析
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", 1))
+S3_DELIMITER = "/"
+# botocore默认的连接池大小
+S3_MAX_POOL_CONNECTIONS = 10
+# 一层串行列出这么多页后还没有列完时，剩下的key按前缀后的下一个字符分段并发列出
+# 每段至少多一次LIST请求，0表示不分段
+S3_LIST_SPLIT_PAGES = int(os.getenv("S3_LIST_SPLIT_PAGES", 0))
+S3_LIST_SPLIT_CHARS = os.getenv("S3_LIST_SPLIT_CHARS", "13579BFJNRVZbfjnrvz")
+ENCODING_GZIP = "gzip"
+ENCODING_ZSTD = "zstd"
+ENCODING_SUFFIXS = {
+    ".gz": ENCODING_GZIP,
+    ".gzip": ENCODING_GZIP,
+    ".zst": ENCODING_ZSTD,
+    ".zstd": ENCODING_ZSTD
+}
+INPUT_PLAYERS = "players"
+INPUT_LOGS = "logs"
 
 
 logger = logging.getLogger()
 
+# engine 预先加载的数据，key: (event, s3_key_prefix, time_str)
+preloaded_players = {}
+preloaded_logs = {}
+# 本次运行已经列出的前缀，key: (bucket_name, prefix)
+listed_objects = {}
+
 
 def valid_date(time_str):
     try:
@@ -41,7 +97,7 @@ def valid_date(time_str):
 
 
 def compare_date(time_str):
-    nowTime_str = datetime.now().strftime(ARG_DATE_FORMAT)
+    nowTime_str = get_today().strftime(ARG_DATE_FORMAT)
     e_time = time.mktime(time.strptime(nowTime_str, ARG_DATE_FORMAT))
     s_time = time.mktime(time.strptime(time_str, ARG_DATE_FORMAT))
     diff = int(s_time)-int(e_time)
@@ -59,11 +115,25 @@ def get_yesterday():
     return get_some_day(-1)
 
 
+# 配置了REPORT_TIMEZONE时，今天按报表时区计算，和日期的时间范围一致
+def get_today():
+    timezone = get_report_timezone()
+    if timezone is None:
+        return date.today()
+    return datetime.now(timezone).date()
+
+
 def get_some_day(days):
-    return (date.today() + timedelta(days)).strftime(ARG_DATE_FORMAT)
+    return (get_today() + timedelta(days)).strftime(ARG_DATE_FORMAT)
 
 
 def get_prefix(s3_key_prefix, days):
+    has_dates = get_has_dates(s3_key_prefix)
+    d = (get_today() + timedelta(days=days))
+    return get_date_prefix(s3_key_prefix, has_dates, d)
+
+
+def get_has_dates(s3_key_prefix):
     has_dates = {}
     for key, values in FILE_PATH_DATES.items():
         for value in values:
@@ -72,7 +142,12 @@ def get_prefix(s3_key_prefix, days):
     if len(has_dates) != len(FILE_PATH_DATES):
         logger.error(f"s3 prefix error. prefix: {s3_key_prefix}")
         raise RuntimeError()
-    d = (date.today() + timedelta(days=days))
+    return has_dates
+
+
+def get_date_prefix(s3_key_prefix, has_dates, d, hour=None):
+    if hour is not None:
+        s3_key_prefix = s3_key_prefix.replace(FILE_PATH_HOUR, hour)
     year = d.strftime("%Y")
     month = get_date_month(has_dates, d)
     day = get_date_day(has_dates, d)
@@ -95,6 +170,8 @@ def get_date_day(has_dates, d):
 
 
 def get_date_paths(s3_key_prefix, day):
+    if FILE_PATH_HOUR in s3_key_prefix:
+        return get_hour_paths(s3_key_prefix, day)
     paths = []
     days = get_days_for_timezone(day)
     for d in days:
@@ -102,8 +179,23 @@ def get_date_paths(s3_key_prefix, day):
     return paths
 
 
+# 本地日期覆盖的每个utc小时一个前缀
+def get_hour_paths(s3_key_prefix, day):
+    has_dates = get_has_dates(s3_key_prefix)
+    time_str = get_some_day(day)
+    start_time = get_start_timestamp_time_str(time_str)
+    end_time = get_end_timestamp_time_str(time_str)
+    paths = []
+    for hour_time in range(
+            start_time - start_time % ONE_HOUR, end_time + 1, ONE_HOUR):
+        d = datetime.utcfromtimestamp(hour_time)
+        paths.append(get_date_prefix(
+            s3_key_prefix, has_dates, d.date(), d.strftime("%H")))
+    return paths
+
+
 def get_date_paths_for_multiple_days(s3_key_prefix, days):
-    today = date.today().strftime(ARG_DATE_FORMAT)
+    today = get_today().strftime(ARG_DATE_FORMAT)
     filter_prefixs_set = set()
     for day in days:
         d = days_compute(today, day)
@@ -114,6 +206,74 @@ def get_date_paths_for_multiple_days(s3_key_prefix, days):
 
 
 def get_players_multiple_days(bucket, event, s3_key_prefix, days, players):
+    if is_preloaded(preloaded_players, event, s3_key_prefix, days):
+        exist = False
+        for day in days:
+            player_map, day_exist = preloaded_players[
+                (event, s3_key_prefix, day)]
+            players.update(player_map)
+            exist = exist or day_exist
+        logger.info(
+            f"Get preloaded players event:{event} ."
+            f"Date start: {days[0]} ."
+            f"end: {days[-1]}."
+            f"player size: {len(players)}")
+        return exist
+    if not snapshot.is_enabled(event):
+        return scan_players_multiple_days(
+            bucket, event, s3_key_prefix, days, players)
+    # 有快照的日期直接合并，没有快照的连续日期一起扫描
+    exist = False
+    missing_days = []
+    for day in days:
+        player_map = snapshot.load(event, s3_key_prefix, day)
+        if player_map is None:
+            missing_days.append(day)
+        else:
+            players.update(player_map)
+            exist = True
+    for continuous_days in get_continuous_days(missing_days):
+        player_map = new_player_id_map()
+        if not scan_players_multiple_days(
+                bucket, event, s3_key_prefix, continuous_days, player_map):
+            continue
+        exist = True
+        # 文件存在但是没有玩家的日期保存空的快照，和没有快照的日期区分
+        for day in continuous_days:
+            if day_files_exist(bucket, s3_key_prefix, day):
+                snapshot.save(
+                    event, s3_key_prefix, day, player_map,
+                    get_end_timestamp_time_str(day))
+        players.update(player_map)
+    logger.info(
+        f"Get players with snapshot event:{event} ."
+        f"Date start: {days[0]} ."
+        f"end: {days[-1]}."
+        f"missing days: {missing_days} .")
+    return exist
+
+
+# 前缀在扫描时已经列出过，不会再请求s3
+def day_files_exist(bucket, s3_key_prefix, time_str):
+    today = get_today().strftime(ARG_DATE_FORMAT)
+    for filter_prefix in get_date_paths(
+            s3_key_prefix, days_compute(today, time_str)):
+        if len(list_objects(bucket, filter_prefix)) > 0:
+            return True
+    return False
+
+
+def get_continuous_days(days):
+    ret = []
+    for day in sorted(days):
+        if len(ret) > 0 and get_some_day_of_one_day(ret[-1][-1], 1) == day:
+            ret[-1].append(day)
+        else:
+            ret.append([day])
+    return ret
+
+
+def scan_players_multiple_days(bucket, event, s3_key_prefix, days, players):
     filter_prefixs = get_date_paths_for_multiple_days(s3_key_prefix, days)
     filter_prefixs, exist = files_exist(
         bucket, filter_prefixs, event)
@@ -134,7 +294,19 @@ def get_players_multiple_days(bucket, event, s3_key_prefix, days, players):
 
 
 def get_players(bucket, event, s3_key_prefix, day):
-    player_map = PlayerIdMap()
+    time_str = get_some_day(day)
+    if is_preloaded(preloaded_players, event, s3_key_prefix, [time_str]):
+        player_map, exist = preloaded_players[
+            (event, s3_key_prefix, time_str)]
+        logger.info(
+            f"Get preloaded players event:{event} ."
+            f"date: {time_str} ."
+            f"player size: {player_map.size()}")
+        return player_map, exist
+    player_map = snapshot.load(event, s3_key_prefix, time_str)
+    if player_map is not None:
+        return player_map, True
+    player_map = new_player_id_map()
     filter_prefixs = get_date_paths(s3_key_prefix, day)
     filter_prefixs, exist = files_exist(bucket, filter_prefixs, event)
     if not exist:
@@ -144,6 +316,7 @@ def get_players(bucket, event, s3_key_prefix, day):
     for filter_prefix in filter_prefixs:
         add_player(
             bucket, player_map, event, filter_prefix, start_time, end_time)
+    snapshot.save(event, s3_key_prefix, time_str, player_map, end_time)
     logger.info(
         f"Get players event:{event} ."
         f"file prefixs:{filter_prefixs} ."
@@ -151,15 +324,305 @@ def get_players(bucket, event, s3_key_prefix, day):
     return player_map, True
 
 
+def is_preloaded(preloaded, event, s3_key_prefix, time_strs):
+    for time_str in time_strs:
+        if (event, s3_key_prefix, time_str) not in preloaded:
+            return False
+    return True
+
+
+def get_player_inputs(event, s3_key_prefix, time_strs):
+    return [(INPUT_PLAYERS, event, s3_key_prefix, time_str)
+            for time_str in time_strs]
+
+
+def get_log_inputs(event, s3_key_prefix, time_strs):
+    return [(INPUT_LOGS, event, s3_key_prefix, time_str)
+            for time_str in time_strs]
+
+
+# 解析进程中使用，boto3的client不能跨进程传递
+class S3Object():
+    def __init__(self, client, bucket_name, key, e_tag, size=0):
+        self.meta = types.SimpleNamespace(client=client)
+        self.bucket_name = bucket_name
+        self.key = key
+        self.e_tag = e_tag
+        self.size = size
+
+
+process_clients = {}
+worker_local = threading.local()
+
+
+def get_process_client(region_name):
+    if region_name not in process_clients:
+        process_clients[region_name] = boto3.client(
+            "s3", region_name, config=get_s3_config())
+    return process_clients[region_name]
+
+
+# 连接池不小于并发线程数
+def get_s3_config():
+    return Config(max_pool_connections=max(
+        S3_MAX_POOL_CONNECTIONS, S3_MAX_WORKERS))
+
+
+# 结果和objs的顺序一致，合并结果是确定的
+# 在工作线程中再次调用时串行执行，并发的请求数不超过S3_MAX_WORKERS
+def map_objects(func, objs, *args):
+    if (S3_MAX_WORKERS <= 1 or len(objs) <= 1 or
+            getattr(worker_local, "in_worker", False)):
+        return [func(obj, *args) for obj in objs]
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        return list(executor.map(
+            lambda obj: run_in_worker(func, obj, args), objs))
+
+
+def run_in_worker(func, obj, args):
+    worker_local.in_worker = True
+    return func(obj, *args)
+
+
+# client是线程安全的，resource不是
+# 压缩的对象边读边解压，不会整个读到内存
+def read_lines(obj):
+    response = obj.meta.client.get_object(
+        Bucket=obj.bucket_name, Key=obj.key)
+    body = get_decompressed_body(
+        obj.key, response.get("ContentEncoding"), response["Body"])
+    stream = encodings.utf_8.StreamReader(body)
+    for line in stream:
+        yield line
+
+
+def get_decompressed_body(key, content_encoding, body):
+    encoding = get_encoding(key, content_encoding)
+    if encoding == ENCODING_GZIP:
+        return gzip.GzipFile(fileobj=body, mode="rb")
+    if encoding == ENCODING_ZSTD:
+        if zstandard is None:
+            logger.error(
+                f"zstandard is not installed. file name: {key}")
+            raise RuntimeError()
+        return zstandard.ZstdDecompressor().stream_reader(
+            body, read_across_frames=True)
+    return body
+
+
+# Content-Encoding优先，没有时按后缀判断
+def get_encoding(key, content_encoding):
+    if content_encoding:
+        content_encoding = content_encoding.strip().lower()
+        if content_encoding in (ENCODING_GZIP, ENCODING_ZSTD):
+            return content_encoding
+    for suffix, encoding in ENCODING_SUFFIXS.items():
+        if key.endswith(suffix):
+            return encoding
+    return None
+
+
 def add_player(bucket, players, event, filter_prefix, start_time, end_time):
-    ret = set()
-    for obj in bucket.objects.filter(Prefix=filter_prefix):
-        stream = encodings.utf_8.StreamReader(obj.get()["Body"])
-        stream.readline
-        for line in stream:
-            log = get_log(line, event, start_time, end_time)
-            if log:
-                add_player_id(players, log)
+    days = set(get_date_list(
+        get_local_time_str(start_time), get_local_time_str(end_time)))
+    objs = objindex.filter_objects(
+        list_objects(bucket, filter_prefix), event, start_time, end_time)
+    summary = get_players_summary(objs, [event], {event: days})
+    add_summary(players, summary[event])
+
+
+def add_summary(players, event_summary):
+    for (day, platform, channel), player_ids in event_summary.items():
+        players.put_ids(day, platform, channel, player_ids)
+
+
+# 多个对象的结果合并，只保留days中的天
+# days: {event: set(day)}
+def get_players_summary(objs, events, days):
+    summary = {event: {} for event in events}
+    window = get_parse_window(set().union(*days.values()))
+    if PARSE_PROCESSES <= 1 or len(objs) <= 1:
+        for object_summary in map_objects(
+                get_object_summary, objs, events, window):
+            merge_summary(summary, object_summary, days)
+        objindex.save()
+        return summary
+    shards = get_shards(objs, PARSE_PROCESSES)
+    region_name = objs[0].meta.client.meta.region_name
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = []
+        for shard in shards:
+            keys = [(obj.key, obj.e_tag, obj.size) for obj in shard]
+            futures.append(executor.submit(
+                parse_shard, region_name, objs[0].bucket_name, keys, events,
+                days, window))
+        for future in futures:
+            shard_summary, entries = future.result()
+            merge_summary(summary, shard_summary, days)
+            objindex.extend_pending(entries)
+    objindex.save()
+    logger.info(
+        f"Parse objects in processes. object size: {len(objs)} ."
+        f"process size: {len(shards)}")
+    return summary
+
+
+# 在解析进程中执行，只返回去重后的id集合和新记录的对象索引
+def parse_shard(region_name, bucket_name, keys, events, days, window):
+    client = get_process_client(region_name)
+    objs = [S3Object(client, bucket_name, key, e_tag, size)
+            for key, e_tag, size in keys]
+    summary = {event: {} for event in events}
+    try:
+        for object_summary in map_objects(
+                get_object_summary, objs, events, window):
+            merge_summary(summary, object_summary, days)
+    finally:
+        flush_log_handlers()
+    return summary, objindex.take_pending()
+
+
+# 解析进程退出时不会执行logging.shutdown，需要主动写出日志
+# 写日志失败不影响解析的结果
+def flush_log_handlers():
+    for handler in logging.getLogger().handlers:
+        try:
+            handler.flush()
+        except Exception as e:
+            sys.stderr.write(f"Flush logs failed. error: {e}\n")
+
+
+def merge_summary(summary, other, days):
+    for event, event_summary in summary.items():
+        event_days = days[event]
+        for key, player_ids in other[event].items():
+            if key[0] not in event_days:
+                continue
+            ids = event_summary.get(key)
+            if ids is None:
+                event_summary[key] = player_ids
+            else:
+                ids.update(player_ids)
+
+
+# 按对象大小分配，每个进程的数据量接近
+def get_shards(objs, count):
+    shards = [[] for _ in range(min(count, len(objs)))]
+    sizes = [0] * len(shards)
+    for obj in sorted(objs, key=lambda obj: obj.size, reverse=True):
+        index = sizes.index(min(sizes))
+        shards[index].append(obj)
+        sizes[index] = sizes[index] + obj.size
+    return shards
+
+
+# 单个对象解析后的结果
+# {event: {(day, platform, channel): set(player_id)}}
+# 按对象的key和ETag缓存，对象不变就不用重新解析
+def get_object_summary(obj, events, window=None):
+    summary = load_object_summary(obj)
+    missing = [event for event in events if event not in summary]
+    if len(missing) > 0:
+        parsed, _ = parse_object(obj, missing, [], window)
+        summary.update(parsed)
+        save_object_summary(obj, summary)
+    return summary
+
+
+def load_object_summary(obj):
+    summary = cache.get(get_summary_name(obj))
+    if summary is None:
+        return {}
+    return summary
+
+
+def save_object_summary(obj, summary):
+    if not cache.is_enabled():
+        return
+    cached = load_object_summary(obj)
+    cached.update(summary)
+    cache.put(get_summary_name(obj), cached)
+
+
+# 日期是按本地时区计算的，时区也是缓存key的一部分
+def get_summary_name(obj):
+    return obj.key + "_" + obj.e_tag + "_" + get_timezone_name()
+
+
+def get_timezone_name():
+    if not is_empty(REPORT_TIMEZONE):
+        return REPORT_TIMEZONE.strip()
+    return (str(time.timezone) + "_" + str(time.altzone) + "_" +
+            "_".join(time.tzname))
+
+
+@lru_cache(maxsize=1)
+def get_report_timezone():
+    if is_empty(REPORT_TIMEZONE):
+        return None
+    if ZoneInfo is None:
+        logger.error(
+            f"zoneinfo is not available. REPORT_TIMEZONE: {REPORT_TIMEZONE}")
+        raise RuntimeError()
+    return ZoneInfo(REPORT_TIMEZONE.strip())
+
+
+# 日期覆盖的时间范围(闭区间)，范围外的行不解析json
+# 缓存保存的是整个对象的结果，开启缓存时不能按时间过滤
+def get_parse_window(time_strs):
+    if cache.is_enabled() or len(time_strs) == 0:
+        return None
+    return (get_start_timestamp_time_str(min(time_strs)),
+            get_end_timestamp_time_str(max(time_strs)))
+
+
+def in_window(log_time, window):
+    return window is None or window[0] <= log_time <= window[1]
+
+
+# 解析时顺便记录对象索引，之后可以跳过不包含事件或时间的对象
+# 先比较event和时间，window外的行不解析json
+def parse_object(obj, summary_events, log_events, window=None):
+    summary = {event: {} for event in summary_events}
+    logs = {event: [] for event in log_events}
+    entry = objindex.new_entry(obj)
+    for line in read_lines(obj):
+        sub_lines = split_line(line)
+        if entry is not None:
+            objindex.add_line(entry, sub_lines)
+        if not sub_lines:
+            continue
+        event = sub_lines[1]
+        if event not in logs and event not in summary:
+            continue
+        log_time = int(sub_lines[0])
+        if not in_window(log_time, window):
+            continue
+        if event in logs:
+            log = decode_log(line, sub_lines, log_time)
+            if not log:
+                continue
+            logs[event].append(log)
+            if event in summary:
+                add_summary_player(summary[event], (
+                    log["player_id"], get_platform(log), get_channel(log),
+                    log["time"]))
+        else:
+            player = decode_player(line, sub_lines, log_time)
+            if player:
+                add_summary_player(summary[event], player)
+    objindex.record(obj, entry)
+    return summary, logs
+
+
+def add_summary_player(event_summary, player):
+    player_id, platform, channel, log_time = player
+    key = (get_local_day(log_time), platform, channel)
+    player_ids = event_summary.get(key)
+    if player_ids is None:
+        player_ids = set()
+        event_summary[key] = player_ids
+    player_ids.add(player_id)
 
 
 @dispatch(set, dict)
@@ -201,21 +664,24 @@ def get_channel(log):
 
 # log format:time event json obj
 def get_player_id(event, line, start_time, end_time):
-    sub_lines = line.split(" ")
+    sub_lines = line.split(" ", 2)
     if len(sub_lines) < 3:
         raise RuntimeError()
-    try:
-        obj = json.loads(sub_lines[2])
-        if sub_lines[1] == event:
-            log_time = int(sub_lines[0])
-            if log_time >= start_time and log_time < end_time:
-                return (obj["player_id"], log_time)
-    except json.JSONDecodeError:
-        logger.error(f"Json parse error. json string is: {line}")
+    player = get_window_player(line, sub_lines, event, start_time, end_time)
+    if player:
+        return (player[0], player[3])
     return (INVALID_VALUE, INVALID_VALUE)
 
 
 def get_logs(bucket, event, s3_key_prefix, days):
+    time_str = get_some_day(days)
+    if is_preloaded(preloaded_logs, event, s3_key_prefix, [time_str]):
+        logs, exist = preloaded_logs[(event, s3_key_prefix, time_str)]
+        logger.info(
+            f"Get preloaded logs event:{event} ."
+            f"date: {time_str} ."
+            f"log size: {len(logs)}")
+        return logs, exist
     logs = []
     filter_prefixs = get_date_paths(s3_key_prefix, days)
     filter_prefixs, exist = files_exist(
@@ -234,31 +700,68 @@ def get_logs(bucket, event, s3_key_prefix, days):
 
 
 def add_logs(bucket, logs, event, filter_prefix, start_time, end_time):
-    for obj in bucket.objects.filter(Prefix=filter_prefix):
-        stream = encodings.utf_8.StreamReader(obj.get()["Body"])
-        stream.readline
-        for line in stream:
-            obj = get_log(line, event, start_time, end_time)
-            if obj:
-                logs.append(obj)
+    objs = objindex.filter_objects(
+        list_objects(bucket, filter_prefix), event, start_time, end_time)
+    for object_logs in map_objects(
+            get_object_logs, objs, event, start_time, end_time):
+        logs.extend(object_logs)
+
+
+def get_object_logs(obj, event, start_time, end_time):
+    logs = []
+    for line in read_lines(obj):
+        log = get_log(line, event, start_time, end_time)
+        if log:
+            logs.append(log)
+    return logs
 
 
 # log format:time event json obj
-def get_log(line, event, start_time, end_time):
-    sub_lines = line.split(" ")
+# 只分割前两个空格，json中可以有空格
+def split_line(line):
+    sub_lines = line.split(" ", 2)
     if len(sub_lines) < 3:
         logger.error(f"line format error. line: {line}")
         return None
+    return sub_lines
+
+
+# 先比较event和时间，符合条件的行才解析json
+def get_log(line, event, start_time, end_time):
+    sub_lines = split_line(line)
+    if not sub_lines or sub_lines[1] != event:
+        return None
+    log_time = int(sub_lines[0])
+    if log_time < start_time or log_time >= end_time:
+        return None
+    return decode_log(line, sub_lines, log_time)
+
+
+def get_window_player(line, sub_lines, event, start_time, end_time):
+    if sub_lines[1] != event:
+        return None
+    log_time = int(sub_lines[0])
+    if log_time < start_time or log_time >= end_time:
+        return None
+    return decode_player(line, sub_lines, log_time)
+
+
+def decode_log(line, sub_lines, log_time):
     try:
         obj = json.loads(sub_lines[2])
-        if sub_lines[1] == event:
-            log_time = int(sub_lines[0])
-            if log_time >= start_time and log_time < end_time:
-                obj["time"] = log_time
-                return obj
     except json.JSONDecodeError:
         logger.error(f"Json parse error. json string is: {line}")
-    return None
+        return None
+    obj["time"] = log_time
+    return obj
+
+
+# 只取需要的字段：(player_id, platform, channel, time)
+def decode_player(line, sub_lines, log_time):
+    obj = decode_log(line, sub_lines, log_time)
+    if obj is None:
+        return None
+    return (obj["player_id"], get_platform(obj), get_channel(obj), log_time)
 
 
 def get_timestamp(time_str):
@@ -267,7 +770,7 @@ def get_timestamp(time_str):
 
 
 def get_days_with_today(any_day):
-    today = date.today().strftime(ARG_DATE_FORMAT)
+    today = get_today().strftime(ARG_DATE_FORMAT)
     date1 = datetime.strptime(today, ARG_DATE_FORMAT)
     date2 = datetime.strptime(any_day, ARG_DATE_FORMAT)
     return (date2-date1).days
@@ -284,63 +787,159 @@ def files_exist(bucket, filter_prefixs, event):
 
 
 def file_exist(bucket, filter_prefix, event):
-    files = bucket.objects.filter(Prefix=filter_prefix)
-    size = 0
-    for b in files:
-        size = size + 1
-    if size == 0:
+    if len(list_objects(bucket, filter_prefix)) == 0:
         logger.warn(
             f"File not exist. file name: {filter_prefix} ."
             f"event: {event}")
         return False
-    for obj in files:
-        if obj.key.find(filter_prefix) < 0:
-            logger.warn(f"File not exist. file name: {filter_prefix}")
-            return False
     return True
 
 
+# 每个前缀只列一次，已经列出的上级前缀可以直接过滤
+def list_objects(bucket, filter_prefix):
+    for (bucket_name, prefix), objs in listed_objects.items():
+        if bucket_name == bucket.name and filter_prefix.startswith(prefix):
+            return [obj for obj in objs if obj.key.startswith(filter_prefix)]
+    objs = list_prefix(bucket.meta.client, bucket.name, filter_prefix)
+    listed_objects[(bucket.name, filter_prefix)] = objs
+    logger.info(
+        f"List objects. prefix: {filter_prefix} ."
+        f"object size: {len(objs)}")
+    return objs
+
+
+# 按目录逐层列出，同一层的子目录并发列出
+def list_prefix(client, bucket_name, filter_prefix):
+    objs = []
+    prefixs = [filter_prefix]
+    while len(prefixs) > 0:
+        sub_prefixs = []
+        for page_objs, page_prefixs in map_objects(
+                list_one_level, prefixs, client, bucket_name):
+            objs.extend(page_objs)
+            sub_prefixs.extend(page_prefixs)
+        prefixs = sub_prefixs
+    objs.sort(key=lambda obj: obj.key)
+    return objs
+
+
+# 平铺的大前缀分页只能串行，超过S3_LIST_SPLIT_PAGES页后按key的范围分段
+# 每段单独分页
+def list_one_level(filter_prefix, client, bucket_name):
+    objs = []
+    sub_prefixs = []
+    kwargs = {}
+    pages = 0
+    while True:
+        page = client.list_objects_v2(
+            Bucket=bucket_name, Prefix=filter_prefix,
+            Delimiter=S3_DELIMITER, **kwargs)
+        page_objs, page_prefixs = get_page_items(
+            client, bucket_name, page, None)
+        objs.extend(page_objs)
+        sub_prefixs.extend(page_prefixs)
+        pages = pages + 1
+        if not page.get("IsTruncated"):
+            return objs, sub_prefixs
+        if is_list_split(pages):
+            break
+        kwargs = {"ContinuationToken": page["NextContinuationToken"]}
+    start_after = max([obj.key for obj in objs] + sub_prefixs)
+    for range_objs, range_prefixs in map_objects(
+            list_range, get_list_ranges(filter_prefix, start_after),
+            client, bucket_name, filter_prefix):
+        objs.extend(range_objs)
+        sub_prefixs.extend(range_prefixs)
+    # 以最后一个子目录开始的范围会再次返回这个子目录
+    return objs, list(dict.fromkeys(sub_prefixs))
+
+
+def is_list_split(pages):
+    return (S3_MAX_WORKERS > 1 and S3_LIST_SPLIT_PAGES > 0 and
+            pages >= S3_LIST_SPLIT_PAGES)
+
+
+# (start_after, end]，最后一段没有上限
+# 分段边界不包含分隔符，同一个子目录不会跨两段
+def get_list_ranges(filter_prefix, start_after):
+    bounds = [filter_prefix + char for char in S3_LIST_SPLIT_CHARS
+              if char != S3_DELIMITER and filter_prefix + char > start_after]
+    return list(zip([start_after] + bounds, bounds + [None]))
+
+
+def list_range(key_range, client, bucket_name, filter_prefix):
+    start_after, end = key_range
+    objs = []
+    sub_prefixs = []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+            Bucket=bucket_name, Prefix=filter_prefix,
+            Delimiter=S3_DELIMITER, StartAfter=start_after):
+        page_objs, page_prefixs = get_page_items(
+            client, bucket_name, page, end)
+        objs.extend(page_objs)
+        sub_prefixs.extend(page_prefixs)
+        # 结果有序，这一页超出范围后之后的页都超出范围
+        if end is not None and is_page_after(page, end):
+            break
+    return objs, sub_prefixs
+
+
+def get_page_items(client, bucket_name, page, end):
+    objs = []
+    sub_prefixs = []
+    for content in page.get("Contents", []):
+        if end is None or content["Key"] <= end:
+            objs.append(S3Object(
+                client, bucket_name, content["Key"], content["ETag"],
+                content["Size"]))
+    for common_prefix in page.get("CommonPrefixes", []):
+        if end is None or common_prefix["Prefix"] <= end:
+            sub_prefixs.append(common_prefix["Prefix"])
+    return objs, sub_prefixs
+
+
+def is_page_after(page, end):
+    keys = [content["Key"] for content in page.get("Contents", [])]
+    keys.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+    return len(keys) > 0 and max(keys) > end
+
+
 def get_paying_users_index_id(player_id, platform, channel):
     return player_id + "_" + platform.lower() + "_" + channel.lower()
 
 
+# s3前缀按utc日期划分，返回本地的一天覆盖的utc日期
 def get_days_for_timezone(day):
-    date_format = "%Y-%m-%d %H:%M:%S"
-    days = []
-    now = datetime.now()
-    local_time_str = now.strftime(date_format)
-    local_time = time.mktime(time.strptime(local_time_str, date_format))
-    utc_time_str = datetime.utcfromtimestamp(local_time).strftime(date_format)
-    utc_time = time.mktime(time.strptime(utc_time_str, date_format))
-    diff = int(local_time)-int(utc_time)
-    if diff > 0:
-        days.append(day-1)
-    if diff < 0:
-        days.append(day+1)
-    days.append(day)
-    return days
+    time_str = get_some_day(day)
+    start_day = datetime.utcfromtimestamp(
+        get_start_timestamp_time_str(time_str)).strftime(ARG_DATE_FORMAT)
+    end_day = datetime.utcfromtimestamp(
+        get_end_timestamp_time_str(time_str)).strftime(ARG_DATE_FORMAT)
+    today = get_today().strftime(ARG_DATE_FORMAT)
+    return [days_compute(today, d) for d in get_date_list(start_day, end_day)]
 
 
+# 没有配置REPORT_TIMEZONE时按本机时区计算
 def get_start_timestamp_time_str(time_str):
-    d = datetime.strptime(time_str, ARG_DATE_FORMAT).date()
-    return int(time.mktime(time.strptime(str(d), ARG_DATE_FORMAT)))
+    d = datetime.strptime(time_str, ARG_DATE_FORMAT)
+    timezone = get_report_timezone()
+    if timezone is not None:
+        d = d.replace(tzinfo=timezone)
+    return int(d.timestamp())
 
 
 def get_end_timestamp_time_str(time_str):
-    dt = datetime.strptime(time_str, ARG_DATE_FORMAT)
-    d = (dt.date() + timedelta(days=1))
-    return int(time.mktime(time.strptime(str(d), ARG_DATE_FORMAT))) - 1
+    return get_start_timestamp_time_str(
+        get_some_day_of_one_day(time_str, 1)) - 1
 
 
 def get_start_timestamp(day):
-    d = (date.today() + timedelta(days=day))
-    return int(time.mktime(time.strptime(str(d), ARG_DATE_FORMAT)))
+    return get_start_timestamp_time_str(get_some_day(day))
 
 
 def get_end_timestamp(day):
-    day = day + 1
-    d = (date.today() + timedelta(days=day))
-    return int(time.mktime(time.strptime(str(d), ARG_DATE_FORMAT))) - 1
+    return get_end_timestamp_time_str(get_some_day(day))
 
 
 def days_compute(today, any_day):
@@ -424,5 +1023,18 @@ def get_some_day_of_one_day(time_str, days):
 
 
 def get_local_time_str(timestamp):
+    timezone = get_report_timezone()
+    if timezone is not None:
+        return datetime.fromtimestamp(timestamp, timezone).strftime(
+            ARG_DATE_FORMAT)
     timeArray = time.localtime(timestamp)
     return time.strftime(ARG_DATE_FORMAT, timeArray)
+
+
+def get_local_day(timestamp):
+    return get_interval_local_day(timestamp // LOCAL_DAY_INTERVAL)
+
+
+@lru_cache(maxsize=4096)
+def get_interval_local_day(interval):
+    return get_local_time_str(interval * LOCAL_DAY_INTERVAL)